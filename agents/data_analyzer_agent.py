@@ -1,79 +1,597 @@
-# agents/search_scraper_agent.py
-# This worker agent is specialized in finding and scraping data from the web.
+# agents/data_analyzer_agent.py
+# This worker agent is specialized in answering questions about scraped data.
+# Tables are queried with LLM-generated DuckDB SQL; plain text is read by the LLM directly.
 
-import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+import functools
+import hashlib
+import json
 import re
+import threading
+from collections import OrderedDict
+from datetime import date, time
+from decimal import Decimal
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+# One in-memory DuckDB database shared by every request. Each call works on its
+# own cursor, and registered views are cursor-local, so concurrent requests can
+# all use the name `data_table` without seeing each other's DataFrames.
+_CON = duckdb.connect(database=':memory:')
+_CON.execute("PRAGMA threads=4")
+
+# --- Static System Prompts ---
+# These are kept byte-identical across calls and always sent as the FIRST message,
+# so OpenAI's automatic prefix caching can reuse them. Anything that varies per
+# request (schema, question, scraped text) goes into the user message AFTER them.
+SQL_SYSTEM_PROMPT_STATIC = """
+You are an expert DuckDB SQL analyst. You translate a natural-language question about a single table into ONE DuckDB SQL query that answers it.
+
+The table is always registered under the name `data_table`. The user message contains the table SCHEMA (column names and types) followed by the QUESTION.
+
+**CRITICAL Rules:**
+1.  **Output Format**: Return a JSON object {"sql": "..."} holding exactly one SQL statement. No explanations, comments, or markdown fences inside the SQL.
+2.  **Quote Every Column**: Always wrap column names in double quotes exactly as they appear in the schema, e.g. "Worldwide gross". Column names are case-sensitive and may contain spaces.
+3.  **Check Column Types**: Columns whose SCHEMA type is numeric (int64, double, Int64, int64[pyarrow], double[pyarrow], ...) already hold clean numbers; use them directly and NEVER apply REGEXP_REPLACE to them. Text columns (str, string, object, category) may still hold numbers stored as text. In text columns, values may contain currency symbols ($, €, £), thousands separators (,), footnote markers in brackets ([1], [a], [nb 2]), and stray letter prefixes such as 'T' or 'F' (e.g. 'T$2,257,844,554'). Clean them before any numeric comparison or aggregation.
+4.  **Cleaning Pattern**: Use TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("col" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE). The CAST to VARCHAR keeps the pattern valid whatever the column's type, since REGEXP functions reject numeric arguments. TRY_CAST returns NULL instead of failing on values that still cannot be parsed.
+5.  **Years and Dates**: A Year column with a numeric SCHEMA type is used directly. Year columns stored as text may contain extra text (e.g. '1997[a]'). Extract the first four-digit number with TRY_CAST(REGEXP_EXTRACT(CAST("Year" AS VARCHAR), '(\\d{4})', 1) AS INTEGER).
+6.  **Ignore NULLs**: When aggregating cleaned values, filter out rows where the cleaned value IS NULL so they do not distort counts or averages.
+7.  **Correlation**: Use the CORR(x, y) aggregate for Pearson correlation, applied to cleaned numeric expressions.
+8.  **Regression Slope**: Use REGR_SLOPE(y, x) for the slope of a least-squares regression line of y on x.
+9.  **Single Answers**: When the question asks for one value (a count, a name, a number), return exactly one row and one column.
+10. **Row Lookups**: When the question asks which row is the earliest, largest, etc., use ORDER BY on the cleaned expression with LIMIT 1 and select only the columns needed to answer.
+11. **Never Invent Columns**: Only use columns that appear in the SCHEMA. If the question uses a different wording, map it to the closest existing column.
+12. **Read-Only**: Never emit INSERT, UPDATE, DELETE, CREATE, DROP or any statement other than SELECT (CTEs with WITH are allowed).
+13. **Batches**: When the user message lists several numbered QUESTIONS, return a JSON object {"queries": [...]} holding one SQL string per question, in the same order. Every other rule applies to each query.
+
+**Canonical Examples** (the SQL that goes in the "sql" field):
+
+Question: How many films grossed more than $2 billion?
+SELECT COUNT(*) FROM data_table WHERE TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("Worldwide gross" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE) > 2000000000
+
+Question: How many films grossed more than $1.5 billion and were released before 2000? (Worldwide gross and Year are str in the SCHEMA)
+SELECT COUNT(*) FROM data_table WHERE TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("Worldwide gross" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE) > 1500000000 AND TRY_CAST(REGEXP_EXTRACT(CAST("Year" AS VARCHAR), '(\\d{4})', 1) AS INTEGER) < 2000
+
+Question: Which is the earliest film that grossed over $1.5 billion? (Worldwide gross and Year are str in the SCHEMA)
+SELECT "Title" FROM data_table WHERE TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("Worldwide gross" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE) > 1500000000 ORDER BY TRY_CAST(REGEXP_EXTRACT(CAST("Year" AS VARCHAR), '(\\d{4})', 1) AS INTEGER) ASC LIMIT 1
+
+Question: What is the correlation between Rank and Peak? (Rank and Peak are int64 in the SCHEMA)
+SELECT CORR("Rank", "Peak") FROM data_table
+
+Question: What is the correlation between Rank and Peak? (Rank and Peak are str in the SCHEMA)
+SELECT CORR(TRY_CAST(REGEXP_REPLACE(CAST("Rank" AS VARCHAR), '[^0-9.\\-]', '', 'g') AS DOUBLE), TRY_CAST(REGEXP_REPLACE(CAST("Peak" AS VARCHAR), '[^0-9.\\-]', '', 'g') AS DOUBLE)) FROM data_table
+
+Question: What is the average population of countries in Asia?
+SELECT AVG(TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("Population" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE)) FROM data_table WHERE "Region" = 'Asia'
+
+Question: Which country has the largest area?
+SELECT "Country" FROM data_table ORDER BY TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("Area" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE) DESC NULLS LAST LIMIT 1
+
+Question: List the top 5 countries by GDP.
+SELECT "Country", "GDP" FROM data_table ORDER BY TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST("GDP" AS VARCHAR), '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE) DESC NULLS LAST LIMIT 5
+
+Question: How many countries are there in each region?
+SELECT "Region", COUNT(*) AS "count" FROM data_table GROUP BY "Region" ORDER BY "count" DESC
 
-def run(url: str) -> pd.DataFrame | str:
+Question: What is the slope of the regression line of Peak on Rank? (Rank and Peak are int64 in the SCHEMA)
+SELECT REGR_SLOPE("Peak", "Rank") FROM data_table
+""".strip()
+
+TEXT_SYSTEM_PROMPT_STATIC = """
+You are a careful research analyst. You answer a question using ONLY the text provided in the user message.
+
+**Rules:**
+- Answer concisely and directly. Prefer a single number, name, or short sentence.
+- Do not use outside knowledge. If the text does not contain the answer, reply exactly: "The answer could not be found in the provided text."
+- Preserve units and currencies as they appear in the text.
+- Do not add explanations, preambles, or markdown formatting.
+- When several numbered QUESTIONS follow the text, return a JSON object {"answers": [...]} with exactly one answer string per question, in the same order.
+
+Based on the following text, answer the question(s) that come after it.
+""".strip()
+
+# --- Rule-Based Fast Path ---
+# Trivial, deterministic questions are answered with fixed SQL instead of an LLM round-trip.
+# Patterns are anchored to the whole question so qualified variants ("how many rows have ...")
+# still go to the LLM.
+_COUNT_ROWS_RE = re.compile(r"^\s*how many (rows|records)( are there)?( in (the )?(table|data|dataset))?\s*\??\s*$", re.IGNORECASE)
+_LIST_COLUMNS_RE = re.compile(r"^\s*(list|show)( me)?( all)?( of)?( the)? (columns|column names)( (of|in) the (table|data|dataset))?\s*\??\s*$", re.IGNORECASE)
+_AGGREGATE_RE = re.compile(
+    r"^\s*(what is |what's )?(the )?(max|maximum|min|minimum|avg|average|mean|sum|total) of (the )?['\"]?(\w[\w ]*?)['\"]?( column)?\s*\??\s*$",
+    re.IGNORECASE
+)
+# A text column takes the aggregate fast path only when at least this share of its
+# values parse as numbers once cleaned like _clean_numeric_sql does
+FAST_PATH_MIN_NUMERIC_RATIO = 0.8
+_CLEAN_NUMERIC_RE = re.compile(r'\[.*?\]|[^0-9.\-]')
+_AGGREGATE_FUNCTIONS = {
+    "max": "MAX", "maximum": "MAX",
+    "min": "MIN", "minimum": "MIN",
+    "avg": "AVG", "average": "AVG", "mean": "AVG",
+    "sum": "SUM", "total": "SUM",
+}
+
+# --- SQL Template Cache ---
+# Questions that differ only in their literal values ("... released before 2000" vs
+# "... released before 1990") share an intent signature. SQL generated for one is
+# stored with those values turned into placeholders and reused for the others on a
+# table with the same columns and shape. A template is only stored when each literal
+# maps to exactly one SQL token in a value position and no other number is left in
+# the SQL, so substitution can never touch a token that plays a different role.
+_LITERAL_RE = re.compile(r"(?<!\w)'([^']+)'(?!\w)|(?<!\w)\"([^\"]+)\"(?!\w)|(?<![\w.])(\d+(?:\.\d+)?)(?![\w.])")
+# SQL string literals, quoted identifiers, and (group 1) numbers outside both
+_SQL_TOKEN_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|(?<![\w.])(\d+(?:\.\d+)?)(?![\w.])")
+# A number scaled by a unit ("2 billion", "15%") never appears verbatim in the SQL
+_UNIT_NUMBER_RE = re.compile(
+    r"(?<![\w.])\d+(?:\.\d+)?\s*(?:%|(?:percent|thousand|million|billion|trillion|bn|mn|[kmb])\b)",
+    re.IGNORECASE
+)
+_FUNCTION_ARG_RE = re.compile(r"[(,]\s*$")
+_LIMIT_RE = re.compile(r"\bLIMIT\s+$", re.IGNORECASE)
+_SIGNATURE_WORD_RE = re.compile(r"<num>|<str>|[a-z0-9_$]+")
+_SIGNATURE_STOPWORDS = frozenset({"a", "an", "the", "please", "tell", "me", "what", "whats", "is", "are"})
+SQL_TEMPLATE_CACHE_SIZE = 512
+_SQL_TEMPLATE_CACHE: OrderedDict[tuple[str, str], str] = OrderedDict()
+_SQL_TEMPLATE_LOCK = threading.Lock()
+
+# --- Structured Output Schemas ---
+# Strict JSON schemas make the model emit exactly these shapes, so the SQL can be
+# read straight out of the parsed response with no fence/markdown scrubbing.
+SQL_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sql_query",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"sql": {"type": "string"}},
+            "required": ["sql"],
+            "additionalProperties": False
+        }
+    }
+}
+TEXT_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "text_answers",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"answers": {"type": "array", "items": {"type": "string"}}},
+            "required": ["answers"],
+            "additionalProperties": False
+        }
+    }
+}
+SQL_BATCH_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "sql_queries",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {"queries": {"type": "array", "items": {"type": "string"}}},
+            "required": ["queries"],
+            "additionalProperties": False
+        }
+    }
+}
+
+
+def run(question: str, llm_client, df: pd.DataFrame = None, text_data: str = None):
     """
-    Entry point for the SearchAndScrapeAgent.
-    It scrapes a URL to find the largest HTML table, then robustly cleans it.
-    Returns a pandas DataFrame if a table is found, otherwise returns a string.
+    Entry point for the DataAnalysisAgent.
+    It answers a question about either a DataFrame (via generated SQL) or plain text.
+    Returns a JSON-serializable value: a scalar for single-value answers,
+    a list of row dicts for tabular answers, or a string for text answers.
     """
-    print(f"SearchAndScrapeAgent: Running on URL -> {url}")
-    
-    if not url:
-        raise ValueError("SearchAndScrapeAgent requires a URL to run.")
-        
+    print(f"DataAnalysisAgent: Running on question -> {question}")
+
+    if not question:
+        raise ValueError("DataAnalysisAgent requires a question to run.")
+
+    if df is not None:
+        return _run_sql_analysis(df, question, llm_client)
+    if text_data is not None:
+        return _run_text_analysis(text_data, question, llm_client)
+
+    raise ValueError("DataAnalysisAgent requires either a DataFrame or text data to analyze.")
+
+
+def run_batch(questions: list[str], llm_client, df: pd.DataFrame = None, text_data: str = None) -> list:
+    """
+    Batch entry point for the DataAnalysisAgent.
+    Answers several questions about the same DataFrame or text in a single LLM call,
+    so the prompt and the schema (or the text) are sent only once.
+    Returns one answer per question, in the same order.
+    """
+    print(f"DataAnalysisAgent: Running batch of {len(questions)} questions.")
+
+    if not questions:
+        raise ValueError("DataAnalysisAgent requires at least one question to run.")
+
+    if df is not None:
+        return _run_sql_batch(df, questions, llm_client)
+    if text_data is not None:
+        return _run_text_batch(text_data, questions, llm_client)
+
+    raise ValueError("DataAnalysisAgent requires either a DataFrame or text data to analyze.")
+
+
+def _run_sql_batch(df: pd.DataFrame, questions: list[str], llm_client) -> list:
+    """Answers several table questions, generating the SQL for all of them in one LLM call."""
+    answers = [None] * len(questions)
+    sql_queries = [None] * len(questions)
+
+    con = _CON.cursor()
     try:
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-        }
-        response = requests.get(url, headers=headers, timeout=25)
-        response.raise_for_status()
-        
-        html_content = response.text
-
-        # --- Strategy 1: Find and Clean HTML Table ---
-        try:
-            # Scrape all tables from the page
-            tables = pd.read_html(html_content)
-            if tables:
-                main_table = max(tables, key=lambda df: df.size)
-
-                # --- NEW: Robust Header Cleaning Process ---
-                # Step 1: Handle multi-level headers by collapsing them.
-                if isinstance(main_table.columns, pd.MultiIndex):
-                    main_table.columns = ['_'.join(map(str, col)).strip() for col in main_table.columns.values]
-
-                # Step 2: If columns are still not strings, the header is likely in the first row.
-                if all(isinstance(c, int) for c in main_table.columns):
-                    # Promote the first row to header
-                    main_table.columns = main_table.iloc[0]
-                    main_table = main_table[1:].reset_index(drop=True)
-
-                # Step 3: Clean the final column names.
-                # Remove non-alphanumeric characters, extra spaces, and citation brackets like [a], [b].
-                def clean_col_name(name):
-                    if not isinstance(name, str):
-                        name = str(name)
-                    name = re.sub(r'\[.*?\]', '', name) # Remove content in brackets
-                    name = re.sub(r'[^A-Za-z0-9_ ]+', '', name) # Remove non-alphanumeric chars except underscore/space
-                    return name.strip()
-
-                main_table.columns = [clean_col_name(col) for col in main_table.columns]
-                
-                print(f"SearchAndScrapeAgent: Success (table found). Cleaned columns: {main_table.columns.tolist()}")
-                return main_table
-                
-        except ValueError:
-            print("SearchAndScrapeAgent: No HTML tables found. Switching to text extraction.")
-
-        # --- Strategy 2: Fallback to text extraction ---
-        soup = BeautifulSoup(html_content, 'lxml')
-        if soup.body:
-            main_text = soup.body.get_text(separator=' ', strip=True)
-            if len(main_text) > 150:
-                print(f"SearchAndScrapeAgent: Success (text found). Returning {len(main_text)} characters.")
-                return main_text
-
-        raise ValueError(f"No usable tables or significant text content could be extracted from the URL: {url}")
-
-    except requests.exceptions.RequestException as e:
-        print(f"SearchAndScrapeAgent Error: Network request failed. {e}")
+        con.register("data_table", _to_arrow(df))
+
+        # Trivial questions are answered locally; only the rest go to the LLM
+        llm_indices = []
+        for i, question in enumerate(questions):
+            if _LIST_COLUMNS_RE.match(question):
+                answers[i] = [str(c) for c in df.columns]
+                continue
+            sql_queries[i] = _fast_path_sql(question, df) or _lookup_sql_template(question, df)
+            if sql_queries[i] is None:
+                llm_indices.append(i)
+
+        if llm_indices:
+            generated = _generate_sql_batch([questions[i] for i in llm_indices], _describe_schema(df), llm_client)
+            for i, sql_query in zip(llm_indices, generated):
+                sql_queries[i] = sql_query
+
+        for i, sql_query in enumerate(sql_queries):
+            if sql_query is None:
+                continue
+            print(f"DataAnalysisAgent: Generated SQL [{i + 1}] -> {sql_query}")
+            result_df = con.execute(sql_query).to_arrow_table().to_pandas(self_destruct=True)
+            answers[i] = _format_result(result_df)
+            if i in llm_indices:
+                _store_sql_template(questions[i], df, sql_query)
+
+        print(f"DataAnalysisAgent: Success. Answered {len(questions)} questions ({len(llm_indices)} via one LLM call).")
+        return answers
+
+    except Exception as e:
+        print(f"DataAnalysisAgent Error: Batch SQL analysis failed. {e}")
+        raise
+    finally:
+        con.unregister("data_table")
+        con.close()
+
+
+def _run_sql_analysis(df: pd.DataFrame, question: str, llm_client):
+    """Generates a DuckDB SQL query with the LLM and executes it against the DataFrame."""
+    if _LIST_COLUMNS_RE.match(question):
+        print("DataAnalysisAgent: Fast path (list columns). Skipping LLM.")
+        return [str(c) for c in df.columns]
+
+    con = _CON.cursor()
+    try:
+        con.register("data_table", _to_arrow(df))
+
+        from_llm = False
+        sql_query = _fast_path_sql(question, df)
+        if sql_query:
+            print("DataAnalysisAgent: Fast path matched. Skipping LLM.")
+        else:
+            sql_query = _lookup_sql_template(question, df)
+            if sql_query:
+                print("DataAnalysisAgent: SQL template cache hit. Skipping LLM.")
+            else:
+                schema = _describe_schema(df)
+
+                # Whitespace is normalized for the cache key, but case is kept so
+                # literal values in the question (e.g. 'Asia') reach the SQL intact.
+                sql_query = _generate_sql(" ".join(question.split()), tuple(df.columns), df.shape, schema, llm_client)
+                from_llm = True
+
+        print(f"DataAnalysisAgent: Generated SQL -> {sql_query}")
+
+        result_df = con.execute(sql_query).to_arrow_table().to_pandas(self_destruct=True)
+        if from_llm:
+            _store_sql_template(question, df, sql_query)
+        print(f"DataAnalysisAgent: Success. Query returned {len(result_df)} row(s).")
+        return _format_result(result_df)
+
+    except Exception as e:
+        print(f"DataAnalysisAgent Error: SQL analysis failed. {e}")
+        raise
+    finally:
+        con.unregister("data_table")
+        con.close()
+
+
+@functools.lru_cache(maxsize=512)
+def _generate_sql(question: str, columns: tuple, shape: tuple, schema: str, llm_client) -> str:
+    """
+    Asks the LLM for a DuckDB query answering the question.
+    Cached on (question, columns, shape, schema) so repeated questions against a
+    same-shaped table reuse the SQL instead of calling the LLM again.
+    """
+    response = llm_client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SQL_SYSTEM_PROMPT_STATIC},
+            {"role": "user", "content": f"SCHEMA:\n{schema}\n\nQUESTION: {question}"}
+        ],
+        response_format=SQL_RESPONSE_FORMAT,
+        temperature=0
+    )
+    _log_cache_usage(response)
+
+    return json.loads(response.choices[0].message.content)["sql"].strip()
+
+
+def _generate_sql_batch(questions: list[str], schema: str, llm_client) -> list[str]:
+    """Asks the LLM for one DuckDB query per question in a single JSON response."""
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+    response = llm_client.chat.completions.create(
+        model="gpt-4o-mini",
+        messages=[
+            {"role": "system", "content": SQL_SYSTEM_PROMPT_STATIC},
+            {"role": "user", "content": f"SCHEMA:\n{schema}\n\nQUESTIONS:\n{numbered}\n\nReturn the JSON object of queries."}
+        ],
+        response_format=SQL_BATCH_RESPONSE_FORMAT,
+        temperature=0
+    )
+    _log_cache_usage(response)
+
+    content = response.choices[0].message.content
+    queries = json.loads(content).get("queries")
+    if not isinstance(queries, list) or len(queries) != len(questions):
+        raise ValueError(f"Expected {len(questions)} SQL queries from the LLM, got: {content[:200]}")
+    return [str(q).strip() for q in queries]
+
+
+def _describe_schema(df: pd.DataFrame) -> str:
+    """Describes the table so the LLM knows the exact column names and types."""
+    return "\n".join(f"- {c} ({t})" for c, t in df.dtypes.items())
+
+
+def _fast_path_sql(question: str, df: pd.DataFrame) -> str | None:
+    """Returns fixed SQL for trivially-answerable questions, or None if the LLM is needed."""
+    if _COUNT_ROWS_RE.match(question):
+        return "SELECT COUNT(*) FROM data_table"
+
+    match = _AGGREGATE_RE.match(question)
+    if match:
+        column = _match_column(match.group(5), df.columns)
+        if column is not None:
+            func = _AGGREGATE_FUNCTIONS[match.group(3).lower()]
+            quoted = '"' + column.replace('"', '""') + '"'
+            if pd.api.types.is_numeric_dtype(df[column]):
+                return f"SELECT {func}({quoted}) FROM data_table"
+            if _mostly_numeric(df[column]):
+                return f"SELECT {func}({_clean_numeric_sql(quoted)}) FROM data_table"
+
+    return None
+
+
+def _mostly_numeric(series: pd.Series) -> bool:
+    """
+    Tells whether enough of a text column survives numeric cleaning for MAX/SUM/...
+    over the cleaned values to be the answer. Columns like names or regions are
+    left to the LLM, which can answer them lexically.
+    """
+    values = series.dropna()
+    if values.empty:
+        return False
+    cleaned = pd.to_numeric(values.astype(str).str.replace(_CLEAN_NUMERIC_RE, '', regex=True), errors='coerce')
+    return cleaned.notna().mean() >= FAST_PATH_MIN_NUMERIC_RATIO
+
+
+def _parse_intent(question: str) -> tuple[str, list[tuple[str, str]]]:
+    """
+    Splits a question into an intent signature and its literal values.
+    Literals (quoted strings and bare numbers) become typed placeholders in the
+    signature, in order of appearance; stopwords and case are dropped.
+    """
+    literals = []
+
+    def placeholder(match):
+        if match.group(3) is not None:
+            literals.append(("num", match.group(3)))
+            return " <num> "
+        literals.append(("str", match.group(1) if match.group(1) is not None else match.group(2)))
+        return " <str> "
+
+    templated = _LITERAL_RE.sub(placeholder, question).lower()
+    words = _SIGNATURE_WORD_RE.findall(templated)
+    signature = " ".join(w for w in words if w not in _SIGNATURE_STOPWORDS)
+    return signature, literals
+
+
+def _fingerprint(df: pd.DataFrame) -> str:
+    """Identifies a table by its column names and shape."""
+    raw = "|".join(str(c) for c in df.columns) + str(df.shape)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def _lookup_sql_template(question: str, df: pd.DataFrame) -> str | None:
+    """Returns cached SQL for a same-intent question with its literals substituted, or None."""
+    signature, literals = _parse_intent(question)
+    key = (_fingerprint(df), signature)
+    with _SQL_TEMPLATE_LOCK:
+        template = _SQL_TEMPLATE_CACHE.get(key)
+        if template is None:
+            return None
+        _SQL_TEMPLATE_CACHE.move_to_end(key)
+
+    values = [value if kind == "num" else value.replace("'", "''") for kind, value in literals]
+    return template.format(*values)
+
+
+def _store_sql_template(question: str, df: pd.DataFrame, sql_query: str):
+    """Caches generated SQL as a template, unless its literals cannot be placed unambiguously."""
+    if _UNIT_NUMBER_RE.search(question):
+        return
+    signature, literals = _parse_intent(question)
+
+    tokens = list(_SQL_TOKEN_RE.finditer(sql_query))
+    edits = {}
+    for i, (kind, value) in enumerate(literals):
+        if kind == "num":
+            hits = [t for t in tokens if t.group(1) == value]
+            replacement = f"{{{i}}}"
+        else:
+            quoted = "'" + value.replace("'", "''") + "'"
+            hits = [t for t in tokens if t.group() == quoted]
+            replacement = f"'{{{i}}}'"
+        if len(hits) != 1 or hits[0].start() in edits:
+            return
+        if kind == "num" and not _is_value_position(sql_query, hits[0].start(), question, value):
+            return
+        edits[hits[0].start()] = (hits[0].end(), replacement)
+
+    # A number the question does not supply (a group index, a LIMIT, a threshold the
+    # LLM derived from "2 billion") would be silently reused for every other question
+    if any(t.group(1) is not None and t.start() not in edits for t in tokens):
+        return
+
+    # Escape braces already in the SQL (e.g. '\d{4}') so only our placeholders are fields
+    parts = []
+    last = 0
+    for start in sorted(edits):
+        end, replacement = edits[start]
+        parts.append(sql_query[last:start].replace("{", "{{").replace("}", "}}"))
+        parts.append(replacement)
+        last = end
+    parts.append(sql_query[last:].replace("{", "{{").replace("}", "}}"))
+    template = "".join(parts)
+
+    key = (_fingerprint(df), signature)
+    with _SQL_TEMPLATE_LOCK:
+        _SQL_TEMPLATE_CACHE[key] = template
+        _SQL_TEMPLATE_CACHE.move_to_end(key)
+        if len(_SQL_TEMPLATE_CACHE) > SQL_TEMPLATE_CACHE_SIZE:
+            _SQL_TEMPLATE_CACHE.popitem(last=False)
+
+
+def _is_value_position(sql_query: str, start: int, question: str, value: str) -> bool:
+    """
+    Tells whether the SQL number at start is one a question literal may fill.
+    Function arguments never are; a LIMIT is only when the question asks for the
+    top/first N rows with that same N.
+    """
+    before = sql_query[:start]
+    if _LIMIT_RE.search(before):
+        return re.search(rf"\b(?:top|first|last|bottom)\s+{re.escape(value)}\b", question, re.IGNORECASE) is not None
+    return not _FUNCTION_ARG_RE.search(before)
+
+
+def _match_column(name: str, columns):
+    """Finds the DataFrame column matching name case-insensitively, or None."""
+    wanted = name.strip().lower()
+    for col in columns:
+        if str(col).lower() == wanted:
+            return str(col)
+    return None
+
+
+def _clean_numeric_sql(quoted: str) -> str:
+    """Builds the same numeric-cleaning expression the SQL prompt teaches the LLM."""
+    return rf"TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE(CAST({quoted} AS VARCHAR), '\[.*?\]', '', 'g'), '[^0-9.\-]', '', 'g') AS DOUBLE)"
+
+
+def _to_arrow(df: pd.DataFrame):
+    """
+    Converts the DataFrame to a pyarrow Table so DuckDB can scan it zero-copy.
+    Falls back to the DataFrame itself when a column mixes types Arrow cannot unify.
+    """
+    try:
+        return pa.Table.from_pandas(df, preserve_index=False)
+    except pa.ArrowException as e:
+        print(f"DataAnalysisAgent: Arrow conversion failed ({e}). Registering the DataFrame directly.")
+        return df
+
+
+def _run_text_analysis(text_data: str, question: str, llm_client) -> str:
+    """Answers a question about plain text by sending it to the LLM."""
+    try:
+        # The text goes before the question so repeated questions about the
+        # same page share the longest possible cached prefix.
+        response = llm_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": TEXT_SYSTEM_PROMPT_STATIC},
+                {"role": "user", "content": f"TEXT:\n{text_data}\n\nQUESTION: {question}"}
+            ],
+            temperature=0
+        )
+        _log_cache_usage(response)
+
+        answer = response.choices[0].message.content.strip()
+        print(f"DataAnalysisAgent: Success (text). Answer -> {answer[:150]}")
+        return answer
+
+    except Exception as e:
+        print(f"DataAnalysisAgent Error: Text analysis failed. {e}")
         raise
+
+
+def _run_text_batch(text_data: str, questions: list[str], llm_client) -> list[str]:
+    """Answers several questions about plain text in one LLM call."""
+    numbered = "\n".join(f"{i}. {q}" for i, q in enumerate(questions, 1))
+    try:
+        response = llm_client.chat.completions.create(
+            model="gpt-4o-mini",
+            messages=[
+                {"role": "system", "content": TEXT_SYSTEM_PROMPT_STATIC},
+                {"role": "user", "content": f"TEXT:\n{text_data}\n\nQUESTIONS:\n{numbered}"}
+            ],
+            response_format=TEXT_BATCH_RESPONSE_FORMAT,
+            temperature=0
+        )
+        _log_cache_usage(response)
+
+        answers = [a.strip() for a in json.loads(response.choices[0].message.content)["answers"]]
+        if len(answers) != len(questions):
+            raise ValueError(f"Expected {len(questions)} answers from the LLM, got {len(answers)}.")
+        print(f"DataAnalysisAgent: Success (text). Answered {len(questions)} questions in one LLM call.")
+        return answers
+
     except Exception as e:
-        print(f"SearchAndScrapeAgent Error: An unexpected error occurred. {e}")
+        print(f"DataAnalysisAgent Error: Batch text analysis failed. {e}")
         raise
+
+
+def _format_result(result_df: pd.DataFrame):
+    """Collapses a 1x1 result to a plain scalar, otherwise returns a list of row dicts."""
+    if result_df.shape == (1, 1):
+        return _json_value(result_df.iat[0, 0])
+    return [
+        {column: _json_value(value) for column, value in row.items()}
+        for row in result_df.to_dict(orient="records")
+    ]
+
+
+def _json_value(value):
+    """
+    Converts one result cell to a JSON-serializable value.
+    Arrow materializes DuckDB HUGEINT/DECIMAL results (e.g. SUM of an integer
+    column) as decimal.Decimal, which neither orjson nor json can encode.
+    """
+    if isinstance(value, Decimal):
+        return int(value) if value == value.to_integral_value() else float(value)
+    if hasattr(value, "item"):
+        return value.item()
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    if value is None or isinstance(value, (str, int, float, date, time)):
+        return value
+    # Anything else (e.g. an INTERVAL's DateOffset) is reported as text
+    return str(value)
+
+
+def _log_cache_usage(response):
+    """Logs how many prompt tokens were served from OpenAI's prompt cache."""
+    usage = getattr(response, "usage", None)
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    cached_tokens = getattr(details, "cached_tokens", None) if details else None
+    if cached_tokens is not None:
+        print(f"DataAnalysisAgent: Prompt tokens {usage.prompt_tokens}, cached {cached_tokens}.")
@@ -1,68 +1,290 @@
 # agents/search_scraper_agent.py
 # This worker agent is specialized in finding and scraping data from the web.
 
+import asyncio
+import hashlib
+import io
+import json
+import os
+import tempfile
+import time
+from collections import OrderedDict
+import aiohttp
 import pandas as pd
-import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+from lxml import html as lxml_html
+import re
 
-def run(url: str) -> pd.DataFrame | str:
+# Column-name cleaning patterns: citation brackets like [a], and anything that is
+# not alphanumeric, underscore or space.
+_BRACKET_RE = re.compile(r'\[.*?\]')
+_NONALNUM_RE = re.compile(r'[^A-Za-z0-9_ ]+')
+# Currency symbols, thousands separators, percent signs and footnote markers that
+# keep otherwise-numeric cells from parsing as numbers.
+_NUMERIC_JUNK_RE = re.compile(r'[,$€£%]|' + _BRACKET_RE.pattern)
+
+# Text columns with fewer distinct values than this fraction of rows become categoricals
+CATEGORY_MAX_UNIQUE_RATIO = 0.5
+
+HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+}
+
+# aiohttp advertises 'Accept-Encoding: gzip, deflate' by default and adds 'br'
+# when Brotli is installed (pulled in by aiohttp[speedups]), then decompresses transparently.
+
+# A single pooled session shared by every scrape in this process. It is created
+# lazily because an aiohttp session must be built inside a running event loop.
+_SESSION: aiohttp.ClientSession | None = None
+
+def _get_session() -> aiohttp.ClientSession:
+    """Returns the shared aiohttp session, creating it on first use."""
+    global _SESSION
+    if _SESSION is None or _SESSION.closed:
+        _SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=25),
+            headers=HEADERS
+        )
+    return _SESSION
+
+# --- Caching ---
+# Raw pages are kept on disk and revalidated with ETag/Last-Modified once stale,
+# so a 304 answer skips the body download. Parsed results are memoized in memory
+# by content hash, so identical HTML never goes through read_html twice.
+CACHE_DIR = os.getenv("SCRAPE_CACHE_DIR", ".http_cache")
+CACHE_EXPIRE_SECONDS = 3600
+_PARSED_CACHE_SIZE = 32
+_PARSED_CACHE: OrderedDict[str, pd.DataFrame | str] = OrderedDict()
+
+async def close_session():
+    """Closes the shared aiohttp session. Called on application shutdown."""
+    global _SESSION
+    if _SESSION is not None and not _SESSION.closed:
+        await _SESSION.close()
+    _SESSION = None
+
+def clear_cache() -> int:
+    """
+    Drops the parsed-page memo and every on-disk HTTP cache entry, so the next
+    scrape of any URL is a full fetch. Returns how many pages were removed.
+    """
+    _PARSED_CACHE.clear()
+    try:
+        names = os.listdir(CACHE_DIR)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    # Metadata goes first: a reader that still sees a body without it refetches
+    for name in sorted(names, key=lambda n: not n.endswith('.json')):
+        try:
+            os.remove(os.path.join(CACHE_DIR, name))
+        except OSError:
+            continue
+        if name.endswith('.html'):
+            removed += 1
+    return removed
+
+async def run(url: str) -> pd.DataFrame | str:
     """
     Entry point for the SearchAndScrapeAgent.
-    It scrapes a URL to find either the largest HTML table or the main text content.
+    It scrapes a URL to find the largest HTML table, then robustly cleans it.
     Returns a pandas DataFrame if a table is found, otherwise returns a string.
+    Several URLs can be fetched concurrently with asyncio.gather(*[run(u) for u in urls]).
     """
     print(f"SearchAndScrapeAgent: Running on URL -> {url}")
-    
+
     if not url:
         raise ValueError("SearchAndScrapeAgent requires a URL to run.")
-        
+
     try:
-        # Use a common user-agent to mimic a real browser and avoid being blocked
-        headers = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
-            'Accept-Language': 'en-US,en;q=0.9',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Connection': 'keep-alive'
-        }
-        response = requests.get(url, headers=headers, timeout=25)
-        response.raise_for_status()
-        
-        html_content = response.text
+        html_bytes = await _fetch(url)
 
-        # --- Strategy 1: Find all tables and return the largest one as a DataFrame ---
-        try:
-            # Tell pandas that the header is the first row (index 0)
-            tables = pd.read_html(html_content, header=0)
-            if tables:
-                main_table = max(tables, key=lambda df: df.size)
-
-                # --- NEW: Clean the DataFrame ---
-                # 1. Set the first row as the header (if read_html failed)
-                if all(isinstance(col, int) for col in main_table.columns):
-                    main_table.columns = main_table.iloc[0]
-                    main_table = main_table[1:]
-
-                # 2. Reset the index after promoting the header and removing a row
-                main_table.reset_index(drop=True, inplace=True)
-
-                print(f"SearchAndScrapeAgent: Success (found table). Returning table with columns: {main_table.columns.tolist()}")
-                return main_table
-        except ValueError:
-            print("SearchAndScrapeAgent: No HTML tables found. Switching to text extraction.")
-
-        # --- Strategy 2: Fallback to text extraction ---
-        soup = BeautifulSoup(html_content, 'lxml')
-        if soup.body:
-            main_text = soup.body.get_text(separator=' ', strip=True)
-            if len(main_text) > 150:
-                print(f"SearchAndScrapeAgent: Success (found text). Returning {len(main_text)} characters.")
-                return main_text
-
-        raise ValueError(f"No usable tables or significant text content could be extracted from the URL: {url}")
-
-    except requests.exceptions.RequestException as e:
+        digest = hashlib.blake2b(html_bytes).hexdigest()
+        if digest in _PARSED_CACHE:
+            _PARSED_CACHE.move_to_end(digest)
+            print("SearchAndScrapeAgent: Success (parsed cache hit).")
+            return _PARSED_CACHE[digest]
+
+        # Parsing is CPU-bound, so keep it off the event loop
+        result = await asyncio.to_thread(_extract, html_bytes, url)
+
+        _PARSED_CACHE[digest] = result
+        if len(_PARSED_CACHE) > _PARSED_CACHE_SIZE:
+            _PARSED_CACHE.popitem(last=False)
+        return result
+
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"SearchAndScrapeAgent Error: Network request failed. {e}")
         raise
     except Exception as e:
         print(f"SearchAndScrapeAgent Error: An unexpected error occurred. {e}")
         raise
+
+async def _fetch(url: str) -> bytes:
+    """
+    Downloads a page through the on-disk HTTP cache.
+    Fresh entries are served without touching the network; stale ones are
+    revalidated with If-None-Match / If-Modified-Since.
+    """
+    key = hashlib.blake2b(url.encode(), digest_size=16).hexdigest()
+    body_path = os.path.join(CACHE_DIR, f"{key}.html")
+    meta_path = os.path.join(CACHE_DIR, f"{key}.json")
+
+    meta = None
+    if os.path.exists(body_path) and os.path.exists(meta_path):
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            meta = None
+
+    if meta and time.time() - meta["fetched_at"] < CACHE_EXPIRE_SECONDS:
+        print("SearchAndScrapeAgent: HTTP cache hit (fresh).")
+        with open(body_path, 'rb') as f:
+            return f.read()
+
+    conditional_headers = {}
+    if meta and meta.get("etag"):
+        conditional_headers['If-None-Match'] = meta["etag"]
+    if meta and meta.get("last_modified"):
+        conditional_headers['If-Modified-Since'] = meta["last_modified"]
+
+    async with _get_session().get(url, headers=conditional_headers) as response:
+        if response.status == 304 and meta:
+            print("SearchAndScrapeAgent: HTTP cache hit (304 Not Modified).")
+            meta["fetched_at"] = time.time()
+            _write_cache(body_path, None, meta_path, meta)
+            with open(body_path, 'rb') as f:
+                return f.read()
+
+        response.raise_for_status()
+        # Keep the raw bytes: lxml detects the encoding from <meta charset> itself,
+        # which avoids decoding the whole page to a str only to re-encode it.
+        html_bytes = await response.read()
+
+        if 'no-store' not in response.headers.get('Cache-Control', '').lower():
+            meta = {
+                "etag": response.headers.get('ETag'),
+                "last_modified": response.headers.get('Last-Modified'),
+                "fetched_at": time.time()
+            }
+            _write_cache(body_path, html_bytes, meta_path, meta)
+
+    return html_bytes
+
+def _write_cache(body_path: str, body: bytes | None, meta_path: str, meta: dict):
+    """Writes a cache entry atomically. Failures only disable caching, never the scrape."""
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        if body is not None:
+            _replace_file(body_path, body)
+        _replace_file(meta_path, json.dumps(meta).encode('utf-8'))
+    except OSError as e:
+        print(f"SearchAndScrapeAgent: Could not write HTTP cache entry. {e}")
+
+def _replace_file(path: str, data: bytes):
+    """
+    Writes data to a uniquely named temp file in CACHE_DIR, then renames it over path.
+    Each writer gets its own temp file, so concurrent gunicorn workers never interleave.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except OSError:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+def _extract(html_bytes: bytes, url: str) -> pd.DataFrame | str:
+    """Extracts the largest cleaned HTML table, falling back to the page's main text."""
+    # --- Strategy 1: Find and Clean HTML Table ---
+    try:
+        # Pick the table with the most cells using lxml alone, then hand only that
+        # subtree to pandas. Pages like Wikipedia lists carry dozens of small navbox
+        # tables that would otherwise each be parsed into a DataFrame and discarded.
+        root = etree.HTML(html_bytes)
+        tables = root.xpath('//table') if root is not None else []
+        if not tables:
+            raise ValueError("No tables found")
+
+        best_table = max(tables, key=lambda t: t.xpath('count(.//td|.//th)'))
+        main_table = pd.read_html(io.BytesIO(etree.tostring(best_table)))[0]
+
+        # --- NEW: Robust Header Cleaning Process ---
+        # Step 1: Handle multi-level headers by collapsing them.
+        if isinstance(main_table.columns, pd.MultiIndex):
+            main_table.columns = ['_'.join(map(str, col)).strip() for col in main_table.columns.values]
+
+        # Step 2: If columns are still not strings, the header is likely in the first row.
+        if all(isinstance(c, int) for c in main_table.columns):
+            # Promote the first row to header
+            main_table.columns = main_table.iloc[0]
+            main_table = main_table[1:].reset_index(drop=True)
+
+        # Step 3: Clean the final column names.
+        # Remove non-alphanumeric characters, extra spaces, and citation brackets like [a], [b].
+        main_table.columns = (
+            pd.Index(main_table.columns).astype(str)
+            .str.replace(_BRACKET_RE, '', regex=True)
+            .str.replace(_NONALNUM_RE, '', regex=True)
+            .str.strip()
+        )
+
+        # Step 4: Give columns compact, typed storage for DuckDB and plotting.
+        main_table = _optimize_dtypes(main_table)
+
+        print(f"SearchAndScrapeAgent: Success (table found). Cleaned columns: {main_table.columns.tolist()}")
+        return main_table
+
+    except ValueError:
+        print("SearchAndScrapeAgent: No HTML tables found. Switching to text extraction.")
+
+    # --- Strategy 2: Fallback to text extraction ---
+    # lxml's C tree is used directly; inline scripts and styles are dropped so they
+    # don't end up in the LLM prompt.
+    try:
+        doc = lxml_html.fromstring(html_bytes)
+    except (etree.ParserError, ValueError):
+        doc = None
+    if doc is not None:
+        etree.strip_elements(doc, 'script', 'style', 'noscript', with_tail=False)
+        body = doc.find('.//body')
+        main_text = ' '.join((body if body is not None else doc).text_content().split())
+        if len(main_text) > 150:
+            print(f"SearchAndScrapeAgent: Success (text found). Returning {len(main_text)} characters.")
+            return main_text
+
+    raise ValueError(f"No usable tables or significant text content could be extracted from the URL: {url}")
+
+def _optimize_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Converts scraped text columns to compact types.
+    A column becomes numeric only if EVERY non-empty cell parses once currency,
+    separators and footnotes are stripped, so no value is silently turned into NaN.
+    Remaining low-cardinality text columns become categoricals, then everything
+    is moved to pyarrow-backed nullable dtypes.
+    """
+    for i in range(df.shape[1]):
+        series = df.iloc[:, i]
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+
+        non_null = series.notna().sum()
+        if non_null == 0:
+            continue
+
+        numeric = pd.to_numeric(
+            series.astype(str).str.replace(_NUMERIC_JUNK_RE, '', regex=True).str.strip(),
+            errors='coerce'
+        )
+        if numeric.notna().sum() == non_null:
+            df.isetitem(i, numeric)
+        elif series.nunique() / len(series) < CATEGORY_MAX_UNIQUE_RATIO:
+            df.isetitem(i, series.astype('category'))
+
+    return df.convert_dtypes(dtype_backend='pyarrow')
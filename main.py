@@ -2,21 +2,63 @@
 # API server and main entry point for the application.
 
 import os
-from fastapi import FastAPI, HTTPException, UploadFile, File
-from fastapi.responses import JSONResponse
+import codecs
+import logging
+import hashlib
+import secrets
+import orjson
+from contextlib import asynccontextmanager
+from cachetools import TTLCache
+from fastapi import FastAPI, Header, HTTPException, UploadFile, File
+from fastapi.responses import JSONResponse, Response
 from dotenv import load_dotenv
-import orchestrator_agent
 
-# Load environment variables from a .env file
+# Load environment variables from a .env file. This must run before the agents are
+# imported: settings such as LLM_MAX_CONCURRENCY are read at import time.
 load_dotenv()
 
+import orchestrator_agent
+from agents import search_scraper_agent
+
+# The orchestrator reports progress through logging. LOG_LEVEL=DEBUG adds the
+# full plan and per-task steps; at the default INFO they are never formatted.
+# Only the orchestrator's logger gets LOG_LEVEL: the root stays at WARNING, so the
+# openai/httpx clients don't log a line for every request.
+logging.basicConfig(format="%(message)s")
+logging.getLogger(orchestrator_agent.__name__).setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson, which serializes large result payloads
+    (row dicts, base64 images) in C and handles NumPy values and NaN natively.
+    Defined here because FastAPI's own ORJSONResponse is deprecated.
+    """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Closes the scraper's pooled HTTP session when the server shuts down."""
+    yield
+    await search_scraper_agent.close_session()
+
 # --- FastAPI App Initialization ---
 app = FastAPI(
     title="Data Analysis Agent API",
     description="A multi-agent API that analyzes and visualizes data from any source.",
-    version="2.0.0" 
+    version="2.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Rendered JSON bodies of completed results, keyed by a hash of the uploaded prompt.
+# Identical uploads (common in grading/eval loops) are answered without re-running
+# the pipeline.
+_RESULT_CACHE = TTLCache(maxsize=256, ttl=3600)
+
 # Create a single, reusable instance of our agent
 try:
     data_agent = orchestrator_agent.OrchestratorAgent()
@@ -45,17 +87,32 @@ async def analyze_data(questions_file: UploadFile = File(..., alias="questions.t
         )
 
     try:
-        # Read the content of the uploaded file
-        prompt = (await questions_file.read()).decode("utf-8")
+        # Read the uploaded file in chunks, decoding as we go so the raw bytes
+        # and the decoded text are never both held in full
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        parts = []
+        while chunk := await questions_file.read(UPLOAD_CHUNK_SIZE):
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b"", final=True))
+        prompt = "".join(parts)
         print(f"Received task from file: {prompt[:250]}...") # Log first 250 chars
 
+        cache_key = hashlib.blake2b(prompt.encode("utf-8")).hexdigest()
+        if cache_key in _RESULT_CACHE:
+            print("--- Returning cached result ---")
+            return Response(content=_RESULT_CACHE[cache_key], media_type="application/json")
+
         # Execute the task using the agent instance
         print("--- Handing off task to agent ---")
         result = await data_agent.run(prompt=prompt)
         print("--- Agent finished task ---")
-        
-        # The orchestrator is designed to return a JSON-serializable list or dict
-        return JSONResponse(content=result)
+
+        # The orchestrator is designed to return a JSON-serializable list or dict.
+        # Rendering happens here, so only results that serialize are cached, and
+        # they are cached as bytes so hits skip re-serializing.
+        response = ORJSONResponse(content=result)
+        _RESULT_CACHE[cache_key] = response.body
+        return response
 
     except ValueError as ve:
         # Handle specific value errors, which are often user-input related
@@ -64,4 +121,23 @@ async def analyze_data(questions_file: UploadFile = File(..., alias="questions.t
     except Exception as e:
         # Handle unexpected server errors
         print(f"An unexpected error occurred while processing the task: {e}")
-        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"An internal server error occurred: {str(e)}")
+
+@app.post("/api/cache/clear", tags=["Admin"])
+async def clear_cache(x_admin_token: str | None = Header(default=None)):
+    """
+    Drops every cached analysis result, generated plan and scraped source in this
+    worker process. Requires the X-Admin-Token header to match CACHE_ADMIN_TOKEN;
+    without that variable set the endpoint is disabled.
+    """
+    expected = os.getenv("CACHE_ADMIN_TOKEN")
+    if not expected:
+        raise HTTPException(status_code=403, detail="Cache clearing is disabled. Set CACHE_ADMIN_TOKEN to enable it.")
+    if not x_admin_token or not secrets.compare_digest(x_admin_token.encode(), expected.encode()):
+        raise HTTPException(status_code=401, detail="Invalid or missing X-Admin-Token header.")
+
+    cleared = len(_RESULT_CACHE)
+    _RESULT_CACHE.clear()
+    cleared_plans = data_agent.clear_plan_cache() if data_agent else 0
+    cleared_scrapes = data_agent.clear_scrape_cache() if data_agent else search_scraper_agent.clear_cache()
+    return {"status": "ok", "cleared": cleared, "cleared_plans": cleared_plans, "cleared_scrapes": cleared_scrapes}
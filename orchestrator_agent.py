@@ -3,165 +3,836 @@
 # by delegating tasks to specialized worker agents.
 
 import os
-import json
+import re
+import random
+import asyncio
+import hashlib
+import textwrap
+import logging
+import orjson
+import threading
+from dataclasses import dataclass
+import numpy as np
 import pandas as pd
-from openai import OpenAI
+from typing import Annotated, Literal, Union
+from pydantic import BaseModel, Field, HttpUrl, TypeAdapter, ValidationError
+from cachetools import LRUCache, TTLCache
+from openai import AsyncOpenAI, OpenAI, RateLimitError
+
+logger = logging.getLogger(__name__)
 
 # Import the specialized worker agents
 from agents import search_scraper_agent
 from agents import data_analyzer_agent
 from agents import visualization_agent
 
+# --- LLM Clients ---
+# One pair of clients per process, so every orchestration shares the same HTTP
+# connection pools instead of paying a TLS handshake per plan. Planning awaits the
+# async client on the event loop; worker agents run in threads and use the sync one.
+_LLM_CLIENT: OpenAI | None = None
+_ASYNC_LLM_CLIENT: AsyncOpenAI | None = None
+_CLIENT_LOCK = threading.Lock()
+
+def _credentials() -> dict:
+    """Reads the OpenAI credentials from the environment."""
+    api_key = os.getenv("OPENAI_API_KEY")
+    base_url = os.getenv("OPENAI_BASE_URL")
+    
+    if not api_key or not base_url:
+        raise ValueError("OPENAI_API_KEY or OPENAI_BASE_URL not found in environment variables.")
+    return {"api_key": api_key, "base_url": base_url}
+
+def _get_client() -> OpenAI:
+    """Returns the shared synchronous OpenAI client, creating it on first use."""
+    global _LLM_CLIENT
+    with _CLIENT_LOCK:
+        if _LLM_CLIENT is None:
+            _LLM_CLIENT = OpenAI(**_credentials())
+    return _LLM_CLIENT
+
+def _get_async_client() -> AsyncOpenAI:
+    """Returns the shared asynchronous OpenAI client, creating it on first use."""
+    global _ASYNC_LLM_CLIENT
+    with _CLIENT_LOCK:
+        if _ASYNC_LLM_CLIENT is None:
+            _ASYNC_LLM_CLIENT = AsyncOpenAI(**_credentials())
+    return _ASYNC_LLM_CLIENT
+
+# --- LLM Concurrency ---
+# Every LLM request made by an orchestration (planning, analyzer calls, Batch API
+# traffic) holds a slot, so fanned-out plans cannot burst past the account's rate
+# limit. A 429 that still gets through is retried with jittered exponential backoff.
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "20"))
+LLM_MAX_RETRIES = 5
+LLM_BACKOFF_BASE_SECONDS = 1.0
+LLM_BACKOFF_MAX_SECONDS = 30.0
+
+# --- Plan Cache ---
+# Plans are cached by a hash of the normalized prompt, so a repeated request (or one
+# differing only in case or spacing) skips the planning LLM call entirely.
+PLAN_CACHE_SIZE = 256
+_URL_RE = re.compile(r'https?://\S+')
+_WHITESPACE_RE = re.compile(r'\s+')
+# The first complete "url" value in a partially streamed plan
+_PLAN_URL_RE = re.compile(r'"url"\s*:\s*"((?:[^"\\]|\\.)*)"')
+
+def _plan_cache_key(prompt: str) -> str:
+    """
+    Hashes a prompt after lowercasing it and collapsing whitespace.
+    URLs keep their case (paths are case-sensitive) and lose any #fragment,
+    which never changes what is fetched.
+    """
+    parts = []
+    last = 0
+    for match in _URL_RE.finditer(prompt):
+        parts.append(prompt[last:match.start()].lower())
+        parts.append(match.group().split('#', 1)[0])
+        last = match.end()
+    parts.append(prompt[last:].lower())
+    normalized = _WHITESPACE_RE.sub(' ', ''.join(parts)).strip()
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=16).hexdigest()
+
+def _discard_scrapes(scrapes: dict):
+    """Cancels speculative scrape tasks that will not be awaited, silencing any that already failed."""
+    for scrape in scrapes.values():
+        if scrape.done() and not scrape.cancelled():
+            scrape.exception()
+        else:
+            scrape.cancel()
+
+def _freeze_dataframe(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Marks a scraped DataFrame as shared and read-only. NumPy-backed blocks are made
+    non-writeable, so an accidental in-place edit raises instead of corrupting the
+    data seen by other tasks; pyarrow-backed columns are immutable already.
+    """
+    df.attrs["readonly"] = True
+    for block in df._mgr.blocks:
+        if isinstance(block.values, np.ndarray):
+            block.values.flags.writeable = False
+    return df
+
+# Scraped data by URL, reused across requests for an hour so repeat orchestrations
+# on the same source skip the fetch and parse entirely
+SCRAPE_CACHE_SIZE = 128
+SCRAPE_CACHE_TTL_SECONDS = 3600
+
+# Seconds between status checks while waiting on an OpenAI Batch API job
+BATCH_POLL_SECONDS = 30
+
+# Prompts planned per batched planning call. Each plan is budgeted 800 output tokens,
+# so 16 plans stay under gpt-4o-mini's 16,384-token output cap.
+PLANS_PER_CALL = 16
+
+# --- Planner Prompt ---
+# Structured output (built from the Plan model below) pins the plan's shape, so the
+# prompt carries no output-format instructions. The prompt is built once and always
+# sent first and unmodified, so its bytes are a stable prefix. OpenAI only caches
+# prefixes of 1024+ tokens (then billed at a discount); the worked examples keep the
+# prompt above that threshold while also anchoring goal wording and depends_on use.
+PLANNER_SYSTEM_PROMPT = textwrap.dedent("""
+    You plan data-analysis jobs for three worker agents:
+    - SearchAndScrapeAgent: fetches `url`; yields the page's largest table, or its text if it has none.
+    - DataAnalysisAgent: answers `goal`, one self-contained question about the scraped data (SQL over a table, or reading text).
+    - VisualizationAgent: draws the chart described by `params` from the scraped table.
+
+    Rules:
+    1. Task 1 is SearchAndScrapeAgent, with the URL copied exactly from the request.
+    2. One task per user question or chart, in the user's order.
+    3. DataAnalysisAgent goals restate the question completely, naming columns as the user does.
+    4. VisualizationAgent params: plot_type (scatter|bar|line|histogram), x_column, y_column; regression_line, color and linestyle only when asked.
+    5. Plot params that were not asked for are null.
+    6. depends_on holds the 0-based indices of earlier tasks a task must wait for. A task reads the latest scrape
+       before it; to read an older one, list that scrape's index. Otherwise leave it empty unless the request
+       orders two tasks: independent tasks run in parallel.
+
+    Example 1
+    Request: "Please scrape the data from https://en.wikipedia.org/wiki/List_of_highest-grossing_films.
+    1. How many films grossed more than $2 billion and were released before the year 2000?
+    2. What's the correlation between the 'Rank' and 'Peak' columns?
+    3. Draw a scatterplot of Rank versus Peak, and include a dotted red regression line."
+    Plan:
+    {"tasks": [
+      {"agent": "SearchAndScrapeAgent", "goal": "Fetch the table of highest-grossing films.", "url": "https://en.wikipedia.org/wiki/List_of_highest-grossing_films", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "Count how many films have a 'Worldwide gross' greater than $2 billion and a 'Year' before 2000.", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "Calculate the Pearson correlation coefficient between the 'Rank' column and the 'Peak' column.", "depends_on": []},
+      {"agent": "VisualizationAgent", "goal": "Scatter plot of Rank vs. Peak with a dotted red regression line.", "depends_on": [],
+       "params": {"plot_type": "scatter", "x_column": "Rank", "y_column": "Peak", "regression_line": true, "color": "red", "linestyle": "dotted"}}
+    ]}
+
+    Example 2
+    Request: "Read https://en.wikipedia.org/wiki/Ada_Lovelace and tell me: when was she born, who was her father,
+    and which machine did she write about?"
+    Plan:
+    {"tasks": [
+      {"agent": "SearchAndScrapeAgent", "goal": "Fetch the article about Ada Lovelace.", "url": "https://en.wikipedia.org/wiki/Ada_Lovelace", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "On what date was Ada Lovelace born?", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "Who was Ada Lovelace's father?", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "Which machine did Ada Lovelace write about?", "depends_on": []}
+    ]}
+
+    Example 3
+    Request: "Use https://example.org/gdp and https://example.org/population.
+    1. Which Country has the highest GDP?
+    2. Draw a histogram of Population.
+    3. Once question 1 is answered, draw a bar chart of Country vs GDP."
+    Plan:
+    {"tasks": [
+      {"agent": "SearchAndScrapeAgent", "goal": "Fetch the GDP table.", "url": "https://example.org/gdp", "depends_on": []},
+      {"agent": "SearchAndScrapeAgent", "goal": "Fetch the population table.", "url": "https://example.org/population", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "Which 'Country' has the highest 'GDP'?", "depends_on": [0]},
+      {"agent": "VisualizationAgent", "goal": "Histogram of Population.", "depends_on": [],
+       "params": {"plot_type": "histogram", "x_column": "Population", "y_column": null, "regression_line": null, "color": null, "linestyle": null}},
+      {"agent": "VisualizationAgent", "goal": "Bar chart of Country vs. GDP.", "depends_on": [0, 2],
+       "params": {"plot_type": "bar", "x_column": "Country", "y_column": "GDP", "regression_line": null, "color": null, "linestyle": null}}
+    ]}
+
+    Example 4
+    Request: "From https://example.org/stock-prices, what was the average Close in 2023? Also plot a line chart of Date vs Close."
+    Plan:
+    {"tasks": [
+      {"agent": "SearchAndScrapeAgent", "goal": "Fetch the stock price table.", "url": "https://example.org/stock-prices", "depends_on": []},
+      {"agent": "DataAnalysisAgent", "goal": "What was the average 'Close' for rows whose 'Date' falls in 2023?", "depends_on": []},
+      {"agent": "VisualizationAgent", "goal": "Line chart of Date vs. Close.", "depends_on": [],
+       "params": {"plot_type": "line", "x_column": "Date", "y_column": "Close", "regression_line": null, "color": null, "linestyle": null}}
+    ]}
+""").strip()
+
+def _log_cache_usage(usage):
+    """Logs how many planner prompt tokens were served from OpenAI's prompt cache."""
+    details = getattr(usage, "prompt_tokens_details", None) if usage else None
+    cached_tokens = getattr(details, "cached_tokens", None) if details else None
+    if cached_tokens is not None:
+        logger.debug("Orchestrator: Planner prompt tokens %d, cached %d.", usage.prompt_tokens, cached_tokens)
+
+# --- Plan Model ---
+# Plans are parsed and validated in one pass by pydantic-core, then read as typed
+# attributes. The agent name picks the task type, so a malformed plan fails here
+# with a structured error instead of partway through execution.
+class PlotParams(BaseModel):
+    plot_type: Literal["scatter", "bar", "line", "histogram"]
+    x_column: str
+    y_column: str | None = None
+    regression_line: bool | None = None
+    color: str | None = None
+    linestyle: str | None = None
+
+class ScrapeTask(BaseModel):
+    agent: Literal["SearchAndScrapeAgent"]
+    goal: str
+    url: HttpUrl
+    depends_on: list[int] = []
+
+class AnalysisTask(BaseModel):
+    agent: Literal["DataAnalysisAgent"]
+    goal: str
+    depends_on: list[int] = []
+
+class VizTask(BaseModel):
+    agent: Literal["VisualizationAgent"]
+    goal: str
+    params: PlotParams
+    depends_on: list[int] = []
+
+Task = Annotated[Union[ScrapeTask, AnalysisTask, VizTask], Field(discriminator="agent")]
+
+class Plan(BaseModel):
+    tasks: list[Task]
+
+class PlanBatch(BaseModel):
+    plans: list[Plan]
+
+# --- Plan Graph ---
+# A plan runs as a DAG. Each task waits for its explicit depends_on plus the scrape
+# whose data it reads (by default the latest one before it), so independent scrapes
+# and everything reading finished data run concurrently.
+@dataclass
+class _PlanNode:
+    """One unit of work: a single task, or a batch of questions with identical inputs."""
+    tasks: list[int]
+    source: int | None
+    depends_on: set[int]
+
+def _build_graph(plan: Plan) -> list[_PlanNode]:
+    """
+    Turns a plan into graph nodes. Questions that read the same data and wait for the
+    same tasks are merged into one node, so the analyzer answers them in one batch.
+    Dependencies may only point to earlier tasks, which keeps the graph acyclic.
+    """
+    nodes = []
+    batches = {}
+    last_scrape = None
+    for i, task in enumerate(plan.tasks):
+        for dep in task.depends_on:
+            if not 0 <= dep < i:
+                raise ValueError(f"Task {i} depends on task {dep}; dependencies must point to earlier tasks.")
+
+        if isinstance(task, ScrapeTask):
+            nodes.append(_PlanNode([i], None, set(task.depends_on)))
+            last_scrape = i
+            continue
+
+        scrape_deps = [dep for dep in task.depends_on if isinstance(plan.tasks[dep], ScrapeTask)]
+        source = max(scrape_deps) if scrape_deps else last_scrape
+        if source is None:
+            raise ValueError(f"{task.agent} task {i} has no scraped data to work on. The plan must scrape a URL first.")
+        depends_on = set(task.depends_on) | {source}
+
+        if isinstance(task, AnalysisTask):
+            key = (source, frozenset(depends_on))
+            if key in batches:
+                batches[key].tasks.append(i)
+                continue
+            batches[key] = _PlanNode([i], source, depends_on)
+            nodes.append(batches[key])
+        else:
+            nodes.append(_PlanNode([i], source, depends_on))
+    return nodes
+
+# --- Structured Output ---
+# The response formats are derived from the Plan model, so the decoder and the
+# validator can never disagree about the plan's shape.
+_UNSUPPORTED_SCHEMA_KEYS = {"title", "default", "discriminator", "format", "minLength", "maxLength"}
+
+def _strict_schema(node):
+    """
+    Adapts a pydantic JSON schema to OpenAI strict mode: every property required,
+    no additional properties, anyOf instead of oneOf, enum instead of const, and
+    none of the keywords strict mode rejects.
+    """
+    if isinstance(node, list):
+        return [_strict_schema(item) for item in node]
+    if not isinstance(node, dict):
+        return node
+
+    strict = {}
+    for key, value in node.items():
+        if key in _UNSUPPORTED_SCHEMA_KEYS:
+            continue
+        if key in ("properties", "$defs"):
+            strict[key] = {name: _strict_schema(sub) for name, sub in value.items()}
+        elif key == "oneOf":
+            strict["anyOf"] = _strict_schema(value)
+        elif key == "const":
+            strict["enum"] = [value]
+        else:
+            strict[key] = _strict_schema(value)
+
+    if "properties" in strict:
+        strict["required"] = list(strict["properties"])
+        strict["additionalProperties"] = False
+    return strict
+
+def _response_format(model: type[BaseModel]) -> dict:
+    """Builds a strict json_schema response format from a pydantic model."""
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": model.__name__, "strict": True, "schema": _strict_schema(model.model_json_schema())}
+    }
+
+PLAN_RESPONSE_FORMAT = _response_format(Plan)
+# Several prompts planned in one call: plans[i] answers prompt i
+PLANS_RESPONSE_FORMAT = _response_format(PlanBatch)
+
+# Streamed URLs are normalized the same way ScrapeTask.url is, so a speculative
+# scrape is found again under the URL the validated plan carries
+_HTTP_URL = TypeAdapter(HttpUrl)
+
+# --- Rule-Based Fast Planner ---
+# Prompts of the stereotyped shape "<URL> + numbered questions" are planned with
+# regexes instead of an LLM call. Anything ambiguous returns None and falls through
+# to the LLM planner, so the rules only need to be right when they answer.
+
+# URLs end at markdown/HTML delimiters, so "[url](url)" yields the same URL twice
+_PROMPT_URL_RE = re.compile(r'https?://[^\s\[\]<>"\']+')
+_QUESTION_SPLIT_RE = re.compile(r'^\s*\d+[.)]\s+', re.MULTILINE)
+_PLOT_WORD_RE = re.compile(r'\b(plot|chart|graph|scatter\w*|histogram|bar|line)\b', re.IGNORECASE)
+_PLOT_TYPE_RE = re.compile(r'\b(scatter|histogram|bar|line)', re.IGNORECASE)
+# A regression line is styling, not a line chart
+_REGRESSION_LINE_RE = re.compile(r'regression line', re.IGNORECASE)
+# "... of <x> versus <y>" / "... of <x> and <y>"; names stay short and never start with
+# "of"/"the", so a clause is not read as a column
+_COLUMN_WORDS = r"['\"]?((?!(?:of|the)\b)[A-Za-z]\w*(?: \w+){0,3}?)['\"]?"
+_COLUMN_END = r"(?=\s*(?:[,.;]|$)|\s+(?:and|with|along|using|as)\b)"
+_VERSUS_RE = re.compile(rf"(?:of|plot|chart)\s+{_COLUMN_WORDS}\s+(?:vs\.?|versus|against|and)\s+{_COLUMN_WORDS}{_COLUMN_END}", re.IGNORECASE)
+_HISTOGRAM_RE = re.compile(rf"histogram of (?:the )?{_COLUMN_WORDS}(?: column)?{_COLUMN_END}", re.IGNORECASE)
+_COLOR_RE = re.compile(r'\b(red|blue|green|black|orange|purple|gray|grey)\b', re.IGNORECASE)
+_LINESTYLE_RE = re.compile(r'\b(dotted|dashed)\b', re.IGNORECASE)
+
+def _fast_plot_params(question: str) -> dict | None:
+    """Reads plot parameters from a chart request, or returns None if any are unclear."""
+    types = {t.lower() for t in _PLOT_TYPE_RE.findall(_REGRESSION_LINE_RE.sub('', question))}
+    if len(types) != 1:
+        return None
+    plot_type = types.pop()
+
+    if plot_type == "histogram":
+        match = _HISTOGRAM_RE.search(question)
+        if not match:
+            return None
+        params = {"plot_type": plot_type, "x_column": match.group(1)}
+    else:
+        match = _VERSUS_RE.search(question)
+        if not match:
+            return None
+        params = {"plot_type": plot_type, "x_column": match.group(1), "y_column": match.group(2)}
+
+    if "regression" in question.lower():
+        params["regression_line"] = True
+    color = _COLOR_RE.search(question)
+    if color:
+        params["color"] = color.group(1).lower()
+    linestyle = _LINESTYLE_RE.search(question)
+    if linestyle:
+        params["linestyle"] = linestyle.group(1).lower()
+    return params
+
+def _trim_url(url: str) -> str:
+    """Drops sentence punctuation after a URL, keeping a ')' that closes a '(' in it."""
+    while True:
+        trimmed = url.rstrip('.,;:')
+        if trimmed.endswith(')') and trimmed.count(')') > trimmed.count('('):
+            trimmed = trimmed[:-1]
+        if trimmed == url:
+            return url
+        url = trimmed
+
+def _try_fast_plan(prompt: str) -> Plan | None:
+    """Builds a plan for a single-URL prompt with numbered questions, or returns None."""
+    urls = {_trim_url(u) for u in _PROMPT_URL_RE.findall(prompt)}
+    if len(urls) != 1:
+        return None
+    url = urls.pop()
+
+    segments = _QUESTION_SPLIT_RE.split(prompt)
+    preamble, questions = segments[0], [q.strip() for q in segments[1:]]
+    # The URL must be in the preamble, and trailing paragraphs (answer-format notes
+    # and the like) would be glued onto the last question, so both bail out
+    if not questions or url not in preamble or any(not q or "\n\n" in q for q in questions):
+        return None
+
+    tasks = [{"agent": "SearchAndScrapeAgent", "goal": "Fetch the data from the provided URL.", "url": url}]
+    for question in questions:
+        question = " ".join(question.split())
+        if _PLOT_WORD_RE.search(question):
+            params = _fast_plot_params(question)
+            if params is None:
+                return None
+            tasks.append({"agent": "VisualizationAgent", "goal": question, "params": params})
+        else:
+            tasks.append({"agent": "DataAnalysisAgent", "goal": question})
+
+    try:
+        return Plan.model_validate({"tasks": tasks})
+    except ValidationError:
+        return None
+
 class OrchestratorAgent:
     """The master agent that manages the entire data analysis task."""
 
+    # Shared by every orchestrator in the process, like the clients themselves
+    _llm_sema = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+
     def __init__(self):
-        """Initializes the Orchestrator and the OpenAI client using environment variables."""
-        api_key = os.getenv("OPENAI_API_KEY")
-        base_url = os.getenv("OPENAI_BASE_URL")
-        
-        if not api_key or not base_url:
-            raise ValueError("OPENAI_API_KEY or OPENAI_BASE_URL not found in environment variables.")
-        
-        self.llm_client = OpenAI(api_key=api_key, base_url=base_url)
-        print("OrchestratorAgent initialized with provided credentials.")
+        """Initializes the Orchestrator with the shared OpenAI clients, configured from environment variables."""
+        # Sync client for worker agents (they run in threads), async client for planning
+        self.llm_client = _get_client()
+        self.async_llm_client = _get_async_client()
+        # Both caches are only touched from the event loop, so they need no locks
+        self._plan_cache = LRUCache(maxsize=PLAN_CACHE_SIZE)
+        # Prompt keys the fast planner already rejected, so it is not retried on them
+        self._fast_plan_misses = LRUCache(maxsize=PLAN_CACHE_SIZE)
+        # (data_type, data) per URL. DataFrames are frozen and shared by reference.
+        self._scrape_cache = TTLCache(maxsize=SCRAPE_CACHE_SIZE, ttl=SCRAPE_CACHE_TTL_SECONDS)
+        logger.info("OrchestratorAgent initialized with provided credentials.")
 
     async def run(self, prompt: str):
-        """The main execution method for the entire workflow."""
+        """
+        The main execution method for the entire workflow.
+        A scraped DataFrame is frozen and handed to every task by reference, without
+        copies, so worker agents must treat it as read-only. One that needs to
+        modify the data works on its own derived frame (filter, sample, sort).
+        """
         
         # Step 1: Create a high-level plan using the LLM.
-        plan = self._generate_plan(prompt)
-        print("--- Orchestrator Plan ---")
-        print(json.dumps(plan, indent=2))
-        print("-------------------------")
-
-        # This will hold the data as it's passed between agents
-        shared_context = {"original_prompt": prompt}
-        final_results = []
-
-        # Step 2: Execute the plan by calling the worker agents
-        for i, task in enumerate(plan.get("tasks", [])):
-            agent_name = task.get("agent")
-            task_goal = task.get("goal")
-            print(f"\nExecuting Task {i+1}: Delegating to '{agent_name}'")
-            print(f"  Goal: {task_goal}")
-
-            if agent_name == "SearchAndScrapeAgent":
-                data_url = task.get("url")
-                if not data_url:
-                    raise ValueError("URL not found in the plan for SearchAndScrapeAgent.")
-                
-                scraped_data = search_scraper_agent.run(url=data_url)
-                
-                # Store the scraped data (either table or text) in the shared context
-                if isinstance(scraped_data, pd.DataFrame):
-                    shared_context["dataframe"] = scraped_data
-                    shared_context["data_type"] = "table"
-                    print("  -> Stored a DataFrame in shared context.")
-                else:
-                    shared_context["text_data"] = scraped_data
-                    shared_context["data_type"] = "text"
-                    print("  -> Stored text data in shared context.")
-
-            elif agent_name == "DataAnalysisAgent":
-                data_type = shared_context.get("data_type")
-                analysis_result = None
-                
+        # The plan is streamed. As soon as its first URL is complete the scrape starts
+        # speculatively, overlapping the fetch with the rest of planning.
+        speculative_scrapes = {}
+
+        def start_scrape(url: str):
+            try:
+                url = str(_HTTP_URL.validate_python(url))
+            except ValidationError:
+                return
+            if url not in speculative_scrapes:
+                logger.info("Orchestrator: Speculatively scraping %s while the plan streams.", url)
+                speculative_scrapes[url] = asyncio.create_task(self._scrape(url))
+
+        try:
+            plan = await self._generate_plan(prompt, on_url=start_scrape)
+        except BaseException:
+            _discard_scrapes(speculative_scrapes)
+            raise
+
+        # Pretty-printing walks the whole plan, so it only happens when DEBUG is on
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Orchestrator plan:\n%s", plan.model_dump_json(indent=2, exclude_none=True))
+
+        # Step 2: Execute the plan graph, then return results in plan order
+        try:
+            results = await self._execute_graph(plan, _build_graph(plan), speculative_scrapes)
+        finally:
+            # Speculative scrapes for URLs the final plan did not use
+            _discard_scrapes(speculative_scrapes)
+
+        return [results[i] for i in sorted(results)]
+
+    async def _execute_graph(self, plan: Plan, nodes: list, speculative_scrapes: dict) -> dict:
+        """
+        Runs plan nodes with a ready queue: a node starts once every node it depends
+        on has finished. Returns the result of each analysis and visualization task by
+        plan index. The first failure cancels the nodes still running and is raised.
+        """
+        owner = {i: n for n, node in enumerate(nodes) for i in node.tasks}
+        indegree = []
+        dependents = [[] for _ in nodes]
+        for n, node in enumerate(nodes):
+            waits_on = {owner[dep] for dep in node.depends_on}
+            indegree.append(len(waits_on))
+            for m in waits_on:
+                dependents[m].append(n)
+
+        scraped = {}
+        results = {}
+        running = {}
+        # A node can become ready only once, but the started set guards against ever launching one twice
+        started = set()
+
+        def launch(n: int):
+            if n not in started:
+                started.add(n)
+                running[asyncio.create_task(self._run_node(plan, nodes[n], scraped, speculative_scrapes))] = n
+
+        for n in range(len(nodes)):
+            if indegree[n] == 0:
+                launch(n)
+        logger.info("Orchestrator: Executing %d tasks as %d graph nodes (%d ready).", len(plan.tasks), len(nodes), len(running))
+
+        try:
+            while running:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+                # Retrieve every failure in this round, so none is reported as never retrieved
+                errors = [t.exception() for t in done if not t.cancelled() and t.exception() is not None]
+                if errors:
+                    raise errors[0]
+                for finished in done:
+                    n = running.pop(finished)
+                    results.update(finished.result())
+                    for m in dependents[n]:
+                        indegree[m] -= 1
+                        if indegree[m] == 0:
+                            launch(m)
+        except BaseException:
+            for pending in running:
+                if not pending.cancel() and not pending.cancelled():
+                    # Already finished: consume its outcome instead
+                    pending.exception()
+            raise
+        return results
+
+    async def _run_node(self, plan: Plan, node: _PlanNode, scraped: dict, speculative_scrapes: dict) -> dict:
+        """Runs one graph node. Scrapes store their data in scraped; other nodes return {plan index: result}."""
+        task = plan.tasks[node.tasks[0]]
+        for i in node.tasks:
+            logger.debug("Executing task %d: delegating to '%s'. Goal: %s", i + 1, plan.tasks[i].agent, plan.tasks[i].goal)
+
+        match task:
+            case ScrapeTask(url=url):
+                data_url = str(url)
+                speculative = speculative_scrapes.pop(data_url, None)
+                scraped[node.tasks[0]] = await (speculative if speculative else self._scrape(data_url))
+                logger.debug("  -> Stored scraped %s data.", scraped[node.tasks[0]][0])
+                return {}
+
+            case AnalysisTask():
+                data_type, data = scraped[node.source]
+                questions = [plan.tasks[i].goal for i in node.tasks]
                 if data_type == "table":
-                    df = shared_context.get("dataframe")
-                    if df is None: raise ValueError("DataAnalysisAgent cannot run without a dataframe.")
-                    analysis_result = data_analyzer_agent.run(df=df, question=task_goal, llm_client=self.llm_client)
-                
-                elif data_type == "text":
-                    text = shared_context.get("text_data")
-                    if text is None: raise ValueError("DataAnalysisAgent cannot run without text data.")
-                    analysis_result = data_analyzer_agent.run(text_data=text, question=task_goal, llm_client=self.llm_client)
+                    answers = await self._answer_table_questions(data, questions)
                 else:
-                    raise ValueError("No data found in context for DataAnalysisAgent to analyze.")
+                    answers = await self._answer_text_questions(data, questions)
+                return dict(zip(node.tasks, answers))
 
-                final_results.append(analysis_result)
-                print(f"  -> Orchestrator received result: {str(analysis_result)[:150]}...")
-
-            elif agent_name == "VisualizationAgent":
-                df = shared_context.get("dataframe")
-                if df is None:
+            case VizTask(params=params):
+                data_type, df = scraped[node.source]
+                if data_type != "table":
                     raise ValueError("VisualizationAgent cannot run without a dataframe. Ensure the data source contains a table.")
-                
-                plot_params = task.get("params", {})
-                viz_result = visualization_agent.run(df=df, params=plot_params)
-                final_results.append(viz_result)
-                print("  -> Orchestrator received a base64 image.")
+                return {node.tasks[0]: await self._visualize(df, params.model_dump())}
+
+    async def run_many(self, prompts: list[str]) -> list:
+        """
+        Runs several independent prompts, e.g. a benchmark or eval set.
+        Prompts without a cached plan are planned together, PLANS_PER_CALL per LLM
+        call, then every prompt is executed concurrently. Results follow prompt order;
+        a prompt that fails yields its exception in place of a result.
+        """
+        uncached = list(dict.fromkeys(p for p in prompts if self._known_plan(p, _plan_cache_key(p)) is None))
+        if len(uncached) > 1:
+            groups = [uncached[i:i + PLANS_PER_CALL] for i in range(0, len(uncached), PLANS_PER_CALL)]
+            outcomes = await asyncio.gather(*(self._generate_plans_batched(g) for g in groups), return_exceptions=True)
+            for group, outcome in zip(groups, outcomes):
+                if isinstance(outcome, Exception):
+                    logger.warning("Orchestrator: Batched planning of %d prompts failed (%s); they will be planned live.", len(group), outcome)
+        # run() now finds each batched plan in the plan cache, and plans the rest live
+        return await self._run_each(prompts)
 
-        # Step 3: Return the aggregated results
-        return final_results
+    async def plan_batch(self, prompts: list[str], poll: bool = True):
+        """
+        Plans prompts through the OpenAI Batch API: half the price of live calls, with
+        separate rate limits, but results can take up to 24h. Meant for offline and
+        evaluation runs. With poll=False the batch id is returned straight away, to be
+        passed to collect_plan_batch later; otherwise this waits for the batch and
+        returns the results of running every prompt, in prompt order.
+        """
+        lines = []
+        for i, prompt in enumerate(prompts):
+            lines.append(orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": "gpt-4o-mini",
+                    "messages": [
+                        {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+                        {"role": "user", "content": prompt}
+                    ],
+                    "response_format": PLAN_RESPONSE_FORMAT,
+                    "max_tokens": 800
+                }
+            }))
+        batch_file = await self._call_llm(lambda: self.async_llm_client.files.create(
+            file=("plans.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        ))
+        batch = await self._call_llm(lambda: self.async_llm_client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        ))
+        logger.info("Orchestrator: Submitted planning batch %s with %d prompts.", batch.id, len(prompts))
 
+        if not poll:
+            return batch.id
+        return await self.collect_plan_batch(batch.id, prompts)
 
-    def _generate_plan(self, prompt: str) -> dict:
-        """Uses an LLM to decompose a prompt into a multi-agent JSON plan."""
-        print("Orchestrator: Generating multi-agent plan...")
+    async def collect_plan_batch(self, batch_id: str, prompts: list[str]) -> list:
+        """
+        Waits for a planning batch, caches its plans, then runs every prompt.
+        Prompts whose batch request failed are planned live by run() instead, and
+        a prompt that fails to run yields its exception in place of a result.
+        """
+        while True:
+            batch = await self._call_llm(lambda: self.async_llm_client.batches.retrieve(batch_id))
+            if batch.status == "completed":
+                break
+            if batch.status in ("failed", "expired", "cancelled"):
+                raise RuntimeError(f"Planning batch {batch_id} ended with status '{batch.status}'.")
+            logger.info("Orchestrator: Planning batch %s is %s; checking again in %ds.", batch_id, batch.status, BATCH_POLL_SECONDS)
+            await asyncio.sleep(BATCH_POLL_SECONDS)
+
+        # Output lines are not guaranteed to follow input order; custom_id maps them back
+        plans = {}
+        if batch.output_file_id:
+            output = await self._call_llm(lambda: self.async_llm_client.files.content(batch.output_file_id))
+            for line in output.text.splitlines():
+                if not line.strip():
+                    continue
+                record = orjson.loads(line)
+                response = record.get("response") or {}
+                if response.get("status_code") != 200:
+                    logger.warning("Orchestrator: Batch request %s failed; it will be planned live.", record.get("custom_id"))
+                    continue
+                try:
+                    plans[int(record["custom_id"])] = Plan.model_validate_json(response["body"]["choices"][0]["message"]["content"])
+                except ValidationError:
+                    logger.warning("Orchestrator: Batch request %s returned an invalid plan; it will be planned live.", record.get("custom_id"))
+
+        for i, plan in plans.items():
+            self._plan_cache[_plan_cache_key(prompts[i])] = plan
+        logger.info("Orchestrator: Planning batch %s returned %d/%d plans.", batch_id, len(plans), len(prompts))
+
+        return await self._run_each(prompts)
+
+    async def _run_each(self, prompts: list[str]) -> list:
+        """
+        Runs every prompt concurrently, in prompt order. A prompt that fails yields its
+        exception in place of a result, so one bad prompt never discards the others.
+        """
+        results = await asyncio.gather(*(self.run(p) for p in prompts), return_exceptions=True)
+        for prompt, result in zip(prompts, results):
+            if isinstance(result, Exception):
+                logger.warning("Orchestrator: Prompt failed (%s: %s): %.80s", type(result).__name__, result, prompt)
+        return results
+
+    async def _call_llm(self, make_call):
+        """
+        Awaits make_call() while holding an LLM concurrency slot, retrying rate-limit
+        errors with exponential backoff. The slot is released while backing off.
+        """
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            async with self._llm_sema:
+                try:
+                    return await make_call()
+                except RateLimitError:
+                    if attempt == LLM_MAX_RETRIES:
+                        raise
+            delay = min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * 2 ** attempt) * random.uniform(0.5, 1.0)
+            logger.warning("Orchestrator: Rate limited by the LLM API; retrying in %.1fs (attempt %d/%d).", delay, attempt + 1, LLM_MAX_RETRIES)
+            await asyncio.sleep(delay)
+
+    async def _scrape(self, url: str) -> tuple:
+        """Scrapes a URL through the per-URL cache. Returns (data_type, data)."""
+        cached = self._scrape_cache.get(url)
+        if cached is not None:
+            logger.info("Orchestrator: Reusing previously scraped data for %s.", url)
+            return cached
+
+        scraped_data = await search_scraper_agent.run(url=url)
+        if isinstance(scraped_data, pd.DataFrame):
+            data_type = "table"
+            _freeze_dataframe(scraped_data)
+        else:
+            data_type = "text"
+        self._scrape_cache[url] = (data_type, scraped_data)
+        return data_type, scraped_data
+
+    async def _answer_table_questions(self, df: pd.DataFrame, questions: list) -> list:
+        """Answers queued table questions, batching them into one analyzer call when there are several."""
+        # The analyzer is synchronous (OpenAI + DuckDB), so it runs in a worker thread
+        if len(questions) == 1:
+            results = [await self._call_llm(lambda: asyncio.to_thread(data_analyzer_agent.run, df=df, question=questions[0], llm_client=self.llm_client))]
+        else:
+            results = await self._call_llm(lambda: asyncio.to_thread(data_analyzer_agent.run_batch, questions=questions, llm_client=self.llm_client, df=df))
+
+        for result in results:
+            logger.debug("  -> Orchestrator received result: %.150s...", result)
+        return results
+
+    async def _answer_text_questions(self, text: str, questions: list) -> list:
+        """Answers queued questions about scraped text, batching them into one analyzer call when there are several."""
+        if len(questions) == 1:
+            results = [await self._call_llm(lambda: asyncio.to_thread(data_analyzer_agent.run, text_data=text, question=questions[0], llm_client=self.llm_client))]
+        else:
+            results = await self._call_llm(lambda: asyncio.to_thread(data_analyzer_agent.run_batch, questions=questions, llm_client=self.llm_client, text_data=text))
+
+        for result in results:
+            logger.debug("  -> Orchestrator received result: %.150s...", result)
+        return results
+
+    async def _visualize(self, df: pd.DataFrame, params: dict) -> str:
+        """Renders one chart."""
+        # Plotting is CPU-bound; run it in a worker thread so the event loop stays free
+        result = await asyncio.to_thread(visualization_agent.run, df=df, params=params)
+        logger.debug("  -> Orchestrator received a base64 image.")
+        return result
+
+    async def _generate_plan(self, prompt: str, on_url=None) -> Plan:
+        """
+        Uses an LLM to decompose a prompt into a multi-agent JSON plan.
+        The response is streamed; on_url, if given, is called with the first URL
+        as soon as it has fully arrived, before the rest of the plan.
+        """
+        cache_key = _plan_cache_key(prompt)
+        known_plan = self._known_plan(prompt, cache_key)
+        if known_plan is not None:
+            return known_plan
+
+        logger.info("Orchestrator: Generating multi-agent plan...")
         
-        system_prompt = """
-You are a master orchestrator agent. Your primary function is to create a detailed, step-by-step JSON plan to fulfill a user's request by delegating tasks to specialized worker agents.
-
-You have access to the following agents:
-1.  `SearchAndScrapeAgent`: Given a URL, it scrapes data. It can return either a data table (if a `<table>` is found) or the main body of text from the page.
-2.  `DataAnalysisAgent`: Answers a specific question about data. It can analyze a data table using SQL or analyze plain text to extract information.
-3.  `VisualizationAgent`: Creates a plot (e.g., scatter, bar, line) from a data table.
-
-**Your Task:**
-Based on the user's entire prompt, create a JSON object containing a list of tasks.
-
-**Critical Guidelines:**
-- **First Task is always Scraping**: The first task in the list must be `SearchAndScrapeAgent` to retrieve the data from the URL mentioned in the prompt. Extract the URL accurately.
-- **One Task Per Question**: For each distinct question or instruction the user asks about the data, create a separate task object for the appropriate agent (`DataAnalysisAgent` or `VisualizationAgent`).
-- **Formulate Clear Goals**: For `DataAnalysisAgent`, the `goal` must be a clear, self-contained question. The agent is powerful, so you can ask complex questions involving filtering, aggregation, correlation, or finding specific rows.
-- **Specify Visualization Details**: For `VisualizationAgent`, the `goal` should describe the plot. The `params` object must specify `plot_type`, `x_column`, `y_column`, and any styling like `color` or `linestyle` if mentioned.
-- **Strict JSON Output**: Generate ONLY the JSON plan. Do not add any conversational text, explanations, or markdown formatting.
-
-**Example User Request:**
-"Please scrape the data from the page at https://en.wikipedia.org/wiki/List_of_highest-grossing_films.
-1. How many films grossed more than $2 billion and were released before the year 2000?
-2. What's the correlation between the 'Rank' and 'Peak' columns?
-3. Draw a scatterplot of Rank versus Peak, and include a dotted red regression line."
-
-**Example Plan Structure:**
-{
-  "tasks": [
-    {
-      "agent": "SearchAndScrapeAgent",
-      "goal": "Fetch the data from the provided Wikipedia URL.",
-      "url": "https://en.wikipedia.org/wiki/List_of_highest-grossing_films"
-    },
-    {
-      "agent": "DataAnalysisAgent",
-      "goal": "Count how many films have a 'Worldwide gross' greater than $2 billion and a 'Year' before 2000."
-    },
-    {
-      "agent": "DataAnalysisAgent",
-      "goal": "Calculate the Pearson correlation coefficient between the 'Rank' column and the 'Peak' column."
-    },
-    {
-      "agent": "VisualizationAgent",
-      "goal": "Plot Rank vs. Peak with a dotted red regression line.",
-      "params": {
-        "plot_type": "scatter", 
-        "x_column": "Rank", 
-        "y_column": "Peak", 
-        "regression_line": true,
-        "color": "red",
-        "linestyle": "dotted"
-      }
-    }
-  ]
-}
-"""
-        response = self.llm_client.chat.completions.create(
-            model="gpt-4o", # Using a powerful model for robust planning
+        async def stream_plan() -> str:
+            stream = await self.async_llm_client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
+                response_format=PLAN_RESPONSE_FORMAT,
+                max_tokens=800,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            plan_str = ""
+            url_reported = on_url is None
+            async for chunk in stream:
+                _log_cache_usage(getattr(chunk, "usage", None))
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                plan_str += chunk.choices[0].delta.content
+                if not url_reported:
+                    match = _PLAN_URL_RE.search(plan_str)
+                    if match:
+                        url_reported = True
+                        on_url(orjson.loads(f'"{match.group(1)}"'))
+            return plan_str
+
+        # The slot is held until the stream is fully read
+        plan = Plan.model_validate_json(await self._call_llm(stream_plan))
+        self._plan_cache[cache_key] = plan
+        return plan
+
+    async def _generate_plans_batched(self, prompts: list[str]) -> list[Plan]:
+        """Plans several prompts in a single LLM call and stores each plan in the plan cache."""
+        logger.info("Orchestrator: Generating %d plans in one batched call...", len(prompts))
+        numbered = "\n\n".join(f"{i}. {p}" for i, p in enumerate(prompts, 1))
+        response = await self._call_llm(lambda: self.async_llm_client.chat.completions.create(
+            model="gpt-4o-mini",
             messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": PLANNER_SYSTEM_PROMPT},
+                {"role": "user", "content": f"Plan each numbered request. Return 'plans' with exactly one plan per request, in order.\n\n{numbered}"}
             ],
-            response_format={"type": "json_object"}
-        )
-        plan_str = response.choices[0].message.content
-        return json.loads(plan_str)
\ No newline at end of file
+            response_format=PLANS_RESPONSE_FORMAT,
+            max_tokens=800 * len(prompts)
+        ))
+        _log_cache_usage(getattr(response, "usage", None))
+        plans = PlanBatch.model_validate_json(response.choices[0].message.content).plans
+        if len(plans) != len(prompts):
+            raise ValueError(f"Expected {len(prompts)} plans from the batched planning call, got {len(plans)}.")
+
+        for prompt, plan in zip(prompts, plans):
+            self._plan_cache[_plan_cache_key(prompt)] = plan
+        return plans
+
+    def _known_plan(self, prompt: str, cache_key: str) -> Plan | None:
+        """Returns a plan without calling the LLM, from the plan cache or the fast planner."""
+        plan = self._plan_cache.get(cache_key)
+        if plan is not None:
+            logger.info("Orchestrator: Reusing cached plan.")
+            return plan
+        if cache_key in self._fast_plan_misses:
+            return None
+
+        plan = _try_fast_plan(prompt)
+        if plan is None:
+            self._fast_plan_misses[cache_key] = True
+            return None
+        logger.info("Orchestrator: Planned with the rule-based fast planner. Skipping LLM.")
+        self._plan_cache[cache_key] = plan
+        return plan
+
+    def clear_plan_cache(self) -> int:
+        """Drops every cached plan and returns how many were removed."""
+        cleared = len(self._plan_cache)
+        self._plan_cache.clear()
+        self._fast_plan_misses.clear()
+        return cleared
+
+    def clear_scrape_cache(self) -> int:
+        """
+        Drops every scraped source, including the scraper's parsed and on-disk HTTP
+        caches, and returns how many cached sources were removed.
+        """
+        cleared = len(self._scrape_cache)
+        self._scrape_cache.clear()
+        search_scraper_agent.clear_cache()
+        return cleared
\ No newline at end of file
@@ -0,0 +1,65 @@
+# tests/test_data_analyzer.py
+# Regression tests for turning questions into DuckDB results and JSON-ready answers.
+
+import unittest
+
+import duckdb
+import orjson
+import pandas as pd
+
+from agents.data_analyzer_agent import _fast_path_sql, _format_result
+
+
+def _query(sql: str, df: pd.DataFrame):
+    """Runs sql over df (as data_table) the way the agent materializes results."""
+    con = duckdb.connect()
+    con.register("data_table", df)
+    return _format_result(con.execute(sql).to_arrow_table().to_pandas(self_destruct=True))
+
+
+class FormatResultTests(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({"Rank": [1, 2, 3, 4], "Region": ["A", "B", "A", "B"]})
+
+    def test_integer_sum_is_a_plain_int(self):
+        # SUM over int64 is a HUGEINT, which arrow hands back as decimal.Decimal
+        answer = _query("SELECT SUM(Rank) FROM data_table", self.df)
+        self.assertEqual(answer, 10)
+        self.assertIs(type(answer), int)
+
+    def test_row_dicts_are_json_serializable(self):
+        rows = _query(
+            "SELECT Region, SUM(Rank) AS total, AVG(Rank) AS mean, 1.25::DECIMAL(4, 2) AS fixed, "
+            "TIMESTAMP '2024-01-01 12:00:00' AS ts FROM data_table GROUP BY Region ORDER BY Region",
+            self.df
+        )
+        self.assertEqual(rows[0]["total"], 4)
+        self.assertEqual(rows[0]["fixed"], 1.25)
+        self.assertEqual(
+            orjson.loads(orjson.dumps(rows))[1],
+            {"Region": "B", "total": 6, "mean": 3.0, "fixed": 1.25, "ts": "2024-01-01T12:00:00"}
+        )
+
+
+class FastPathTests(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            "Region": pd.Categorical(["Asia", "Europe", "Asia"]),
+            "Gross": ["$1,000[a]", "T$2,500", "$700"],
+            "Rank": [3, 1, 2],
+        })
+
+    def test_numeric_column_is_aggregated_directly(self):
+        self.assertEqual(_fast_path_sql("What is the max of Rank?", self.df), 'SELECT MAX("Rank") FROM data_table')
+
+    def test_numbers_stored_as_text_are_cleaned(self):
+        self.assertEqual(_query(_fast_path_sql("sum of Gross", self.df), self.df), 4200)
+
+    def test_text_column_goes_to_the_llm(self):
+        self.assertIsNone(_fast_path_sql("What is the max of Region?", self.df))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+# tests/test_fast_planner.py
+# Regression tests for the rule-based fast planner in orchestrator_agent.
+
+import unittest
+
+from orchestrator_agent import AnalysisTask, ScrapeTask, VizTask, _try_fast_plan
+
+FILMS_URL = "https://en.wikipedia.org/wiki/List_of_highest-grossing_films"
+
+# The example questions.txt from the README, URL written as a markdown link
+README_PROMPT = (
+    f"Scrape the list of highest grossing films from Wikipedia at [{FILMS_URL}]({FILMS_URL}).\n"
+    "1. How many films grossed more than $2 billion?\n"
+    "2. Draw a scatterplot of Rank vs. Peak with a dotted red regression line.\n"
+)
+
+
+class FastPlannerTests(unittest.TestCase):
+
+    def test_readme_prompt_scrapes_the_linked_url(self):
+        plan = _try_fast_plan(README_PROMPT)
+        self.assertIsNotNone(plan)
+        scrape, question, chart = plan.tasks
+        self.assertIsInstance(scrape, ScrapeTask)
+        self.assertEqual(str(scrape.url), FILMS_URL)
+        self.assertIsInstance(question, AnalysisTask)
+        self.assertIsInstance(chart, VizTask)
+        self.assertEqual(chart.params.plot_type, "scatter")
+        self.assertEqual((chart.params.x_column, chart.params.y_column), ("Rank", "Peak"))
+        self.assertTrue(chart.params.regression_line)
+
+    def test_plain_url_with_trailing_punctuation(self):
+        plan = _try_fast_plan(f"Use {FILMS_URL}.\n1. How many films are listed?\n")
+        self.assertEqual(str(plan.tasks[0].url), FILMS_URL)
+
+    def test_parenthesized_urls_keep_their_closing_parenthesis(self):
+        for url in (
+            "https://en.wikipedia.org/wiki/List_of_countries_by_GDP_(nominal)",
+            "https://en.wikipedia.org/wiki/Mercury_(planet)",
+        ):
+            for prompt in (
+                f"Scrape {url}.\n1. How many rows?\n",
+                f"Scrape {url}\n1. How many rows?\n",
+                f"Scrape ({url}).\n1. How many rows?\n",
+                f"Scrape [{url}]({url}).\n1. How many rows?\n",
+            ):
+                with self.subTest(prompt=prompt):
+                    self.assertEqual(str(_try_fast_plan(prompt).tasks[0].url), url)
+
+    def test_two_different_urls_fall_back_to_llm(self):
+        prompt = f"Compare {FILMS_URL} and https://example.org/other.\n1. How many rows?\n"
+        self.assertIsNone(_try_fast_plan(prompt))
+
+
+if __name__ == "__main__":
+    unittest.main()
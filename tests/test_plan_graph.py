@@ -0,0 +1,144 @@
+# tests/test_plan_graph.py
+# Tests for turning plans into graph nodes and running them with stubbed workers.
+
+import asyncio
+import gc
+import unittest
+
+from orchestrator_agent import OrchestratorAgent, Plan, _build_graph
+
+
+def _plan(*tasks) -> Plan:
+    return Plan.model_validate({"tasks": list(tasks)})
+
+
+def _scrape(url, depends_on=()):
+    return {"agent": "SearchAndScrapeAgent", "goal": "Fetch.", "url": url, "depends_on": list(depends_on)}
+
+
+def _question(goal, depends_on=()):
+    return {"agent": "DataAnalysisAgent", "goal": goal, "depends_on": list(depends_on)}
+
+
+def _chart(x_column, depends_on=()):
+    return {"agent": "VisualizationAgent", "goal": "Plot.", "depends_on": list(depends_on),
+            "params": {"plot_type": "histogram", "x_column": x_column}}
+
+
+class StubAgent(OrchestratorAgent):
+    """An orchestrator whose workers are stubs, recording what each was asked."""
+
+    def __init__(self, fail=(), slow=()):
+        self.fail = set(fail)
+        self.slow = set(slow)
+        self.calls = []
+        self.cancelled = []
+
+    async def _work(self, name):
+        self.calls.append(name)
+        try:
+            if name in self.slow:
+                await asyncio.sleep(10)
+            await asyncio.sleep(0)
+        except asyncio.CancelledError:
+            self.cancelled.append(name)
+            raise
+        if name in self.fail:
+            raise ValueError(f"{name} failed")
+
+    async def _scrape(self, url):
+        await self._work(url)
+        return "table", url
+
+    async def _answer_table_questions(self, df, questions):
+        await self._work(tuple(questions))
+        return [f"{q} @ {df}" for q in questions]
+
+    async def _visualize(self, df, params):
+        await self._work(params["x_column"])
+        return f"chart of {params['x_column']} @ {df}"
+
+
+def _execute(agent, plan):
+    return asyncio.run(agent._execute_graph(plan, _build_graph(plan), {}))
+
+
+class BuildGraphTests(unittest.TestCase):
+
+    def test_questions_on_the_same_source_merge_across_other_tasks(self):
+        plan = _plan(_scrape("https://a.org/"), _question("q1"), _chart("X"), _question("q2"))
+        nodes = _build_graph(plan)
+        self.assertEqual([node.tasks for node in nodes], [[0], [1, 3], [2]])
+        self.assertEqual(nodes[1].depends_on, {0})
+
+    def test_questions_with_different_dependencies_stay_apart(self):
+        plan = _plan(_scrape("https://a.org/"), _question("q1"), _question("q2", depends_on=[1]))
+        self.assertEqual([node.tasks for node in _build_graph(plan)], [[0], [1], [2]])
+
+    def test_tasks_read_the_latest_scrape_unless_they_name_one(self):
+        plan = _plan(_scrape("https://a.org/"), _scrape("https://b.org/"), _question("q1"), _question("q2", depends_on=[0]))
+        sources = {tuple(node.tasks): node.source for node in _build_graph(plan)}
+        self.assertEqual(sources[(2,)], 1)
+        self.assertEqual(sources[(3,)], 0)
+
+    def test_dependencies_must_point_to_earlier_tasks(self):
+        for depends_on in ([2], [1], [-1]):
+            with self.subTest(depends_on=depends_on):
+                plan = _plan(_scrape("https://a.org/"), _question("q1", depends_on=depends_on), _question("q2"))
+                with self.assertRaisesRegex(ValueError, "earlier tasks"):
+                    _build_graph(plan)
+
+    def test_tasks_need_a_scrape_to_read(self):
+        with self.assertRaisesRegex(ValueError, "scrape a URL first"):
+            _build_graph(_plan(_question("q1"), _scrape("https://a.org/")))
+
+
+class ExecuteGraphTests(unittest.TestCase):
+
+    def test_results_by_plan_index_with_questions_batched(self):
+        agent = StubAgent()
+        plan = _plan(_scrape("https://a.org/"), _question("q1"), _chart("X"), _question("q2"))
+        results = _execute(agent, plan)
+        self.assertEqual(results, {
+            1: "q1 @ https://a.org/",
+            2: "chart of X @ https://a.org/",
+            3: "q2 @ https://a.org/",
+        })
+        self.assertIn(("q1", "q2"), agent.calls)
+
+    def test_named_older_scrape_is_read(self):
+        plan = _plan(_scrape("https://a.org/"), _scrape("https://b.org/"), _question("q1"), _question("q2", depends_on=[0]))
+        results = _execute(StubAgent(), plan)
+        self.assertEqual(results, {2: "q1 @ https://b.org/", 3: "q2 @ https://a.org/"})
+
+    def test_dependent_task_starts_after_its_dependency(self):
+        agent = StubAgent()
+        _execute(agent, _plan(_scrape("https://a.org/"), _question("q1"), _chart("X", depends_on=[1])))
+        self.assertLess(agent.calls.index(("q1",)), agent.calls.index("X"))
+
+    def test_first_failure_cancels_running_nodes(self):
+        agent = StubAgent(fail={"X"}, slow={("q1",)})
+        plan = _plan(_scrape("https://a.org/"), _question("q1"), _chart("X"), _chart("Y", depends_on=[2]))
+        with self.assertRaisesRegex(ValueError, "X failed"):
+            _execute(agent, plan)
+        self.assertEqual(agent.cancelled, [("q1",)])
+        self.assertNotIn("Y", agent.calls)
+
+    def test_simultaneous_failures_are_all_retrieved(self):
+        agent = StubAgent(fail={"X", "Y"})
+        plan = _plan(_scrape("https://a.org/"), _chart("X"), _chart("Y"))
+        unretrieved = []
+
+        async def main():
+            asyncio.get_running_loop().set_exception_handler(lambda loop, context: unretrieved.append(context))
+            with self.assertRaisesRegex(ValueError, "failed"):
+                await agent._execute_graph(plan, _build_graph(plan), {})
+            gc.collect()
+            await asyncio.sleep(0)
+
+        asyncio.run(main())
+        self.assertEqual(unretrieved, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+# tests/test_sql_template_cache.py
+# Tests for reusing generated SQL across questions that differ only in their literals.
+
+import unittest
+
+import pandas as pd
+
+from agents import data_analyzer_agent
+from agents.data_analyzer_agent import _lookup_sql_template, _store_sql_template
+
+CLEAN_GROSS = """TRY_CAST(REGEXP_REPLACE(REGEXP_REPLACE("Worldwide gross", '\\[.*?\\]', '', 'g'), '[^0-9.\\-]', '', 'g') AS DOUBLE)"""
+YEAR = """TRY_CAST(REGEXP_EXTRACT("Year", '(\\d{4})', 1) AS INTEGER)"""
+
+
+class SqlTemplateCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        data_analyzer_agent._SQL_TEMPLATE_CACHE.clear()
+        self.df = pd.DataFrame({
+            "Title": ["A", "B"], "Worldwide gross": ["$2,000,000,000", "$900"],
+            "Year": ["1997", "2009"], "Region": ["Asia", "Europe"], "Rank": [1, 2],
+        })
+
+    def test_literals_are_substituted(self):
+        _store_sql_template(
+            "How many films were released before 2000 in 'Asia'?", self.df,
+            """SELECT COUNT(*) FROM data_table WHERE "Year" < 2000 AND "Region" = 'Asia'"""
+        )
+        self.assertEqual(
+            _lookup_sql_template("How many films were released before 1990 in 'Europe'?", self.df),
+            """SELECT COUNT(*) FROM data_table WHERE "Year" < 1990 AND "Region" = 'Europe'"""
+        )
+
+    def test_braces_in_the_sql_survive_substitution(self):
+        _store_sql_template(
+            "Which titles have a Rank above 1?", self.df,
+            """SELECT "Title" FROM data_table WHERE "Rank" > 1 AND REGEXP_MATCHES("Year", '\\d{4}')"""
+        )
+        self.assertEqual(
+            _lookup_sql_template("Which titles have a Rank above 7?", self.df),
+            """SELECT "Title" FROM data_table WHERE "Rank" > 7 AND REGEXP_MATCHES("Year", '\\d{4}')"""
+        )
+
+    def test_literal_bound_to_a_function_argument_is_not_cached(self):
+        # The question's 1 only appears in the SQL as REGEXP_EXTRACT's group index
+        _store_sql_template(
+            "How many films grossed over 1 billion dollars and were released before 2000?", self.df,
+            f"SELECT COUNT(*) FROM data_table WHERE {CLEAN_GROSS} > 1000000000 AND {YEAR} < 2000"
+        )
+        self.assertIsNone(_lookup_sql_template(
+            "How many films grossed over 2 billion dollars and were released before 2010?", self.df
+        ))
+
+    def test_question_numbers_with_units_are_not_cached(self):
+        _store_sql_template(
+            "Which film grossed more than 1 million?", self.df,
+            f"""SELECT "Title" FROM data_table WHERE {CLEAN_GROSS} > 1000000 LIMIT 1"""
+        )
+        self.assertIsNone(_lookup_sql_template("Which film grossed more than 5 million?", self.df))
+
+    def test_limit_is_not_taken_for_an_unrelated_literal(self):
+        _store_sql_template(
+            "Which film is the earliest with Rank above 1?", self.df,
+            """SELECT "Title" FROM data_table WHERE "Rank" > 5 ORDER BY "Year" ASC LIMIT 1"""
+        )
+        self.assertIsNone(_lookup_sql_template("Which film is the earliest with Rank above 3?", self.df))
+
+    def test_limit_is_taken_for_a_top_n_question(self):
+        _store_sql_template(
+            "List the top 5 films by Rank.", self.df,
+            """SELECT "Title" FROM data_table ORDER BY "Rank" LIMIT 5"""
+        )
+        self.assertEqual(
+            _lookup_sql_template("List the top 3 films by Rank.", self.df),
+            """SELECT "Title" FROM data_table ORDER BY "Rank" LIMIT 3"""
+        )
+
+    def test_sql_with_numbers_the_question_does_not_supply_is_not_cached(self):
+        _store_sql_template(
+            "How many films have a Rank below 10?", self.df,
+            """SELECT COUNT(*) FROM data_table WHERE "Rank" < 10 AND "Year" > 1900"""
+        )
+        self.assertIsNone(_lookup_sql_template("How many films have a Rank below 20?", self.df))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+# tests/test_visualization.py
+# Regression tests for how the VisualizationAgent reads its axes.
+
+import unittest
+
+import pandas as pd
+
+from agents import visualization_agent
+
+
+class VisualizationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            "Region": pd.Categorical(["A", "B", "A", "B"]),
+            "Population": [10, 20, 30, 40],
+        })
+
+    def test_bar_chart_shows_the_mean_per_category(self):
+        visualization_agent.run(self.df, {"plot_type": "bar", "x_column": "Region", "y_column": "Population"})
+        # The figure just rendered is the one back in the pool
+        fig = visualization_agent._FIGURE_POOL.get_nowait()
+        try:
+            ax = fig.axes[0]
+            self.assertEqual([t.get_text() for t in ax.get_xticklabels()], ["A", "B"])
+            self.assertEqual([bar.get_height() for bar in ax.patches], [20.0, 30.0])
+        finally:
+            visualization_agent._release_figure(fig)
+
+    def test_text_axis_raises_instead_of_drawing_a_blank_chart(self):
+        for params in (
+            {"plot_type": "scatter", "x_column": "Region", "y_column": "Population"},
+            {"plot_type": "histogram", "x_column": "Region"},
+        ):
+            with self.assertRaisesRegex(ValueError, "no numeric values"):
+                visualization_agent.run(self.df, params)
+
+
+if __name__ == "__main__":
+    unittest.main()